@@ -0,0 +1,52 @@
+import argparse
+import os
+import struct
+
+from pydub import AudioSegment
+
+# Writes the bank layout read by Client/soundbank.py (keep them in sync).
+BANK_MAGIC = b'PSBK'
+BANK_VERSION = 1
+BANK_HEADER = struct.Struct('<4sHIH')
+BANK_ENTRY = struct.Struct('<II')
+SOUND_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+
+def load_sounds(directory, rate):
+    """Decode every sound in directory to mono 16-bit PCM at rate, keyed by lower-case file name."""
+    sounds = {}
+    for file_name in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file_name)
+        if extension.lower() not in SOUND_EXTENSIONS:
+            continue
+        audio = AudioSegment.from_file(os.path.join(directory, file_name))
+        audio = audio.set_channels(1).set_frame_rate(rate).set_sample_width(2)
+        sounds[name.lower()] = audio.raw_data
+        print(f"{file_name}: {len(audio.raw_data) // 2} samples")
+    return sounds
+
+def write_bank(path, rate, sounds):
+    names = [name.encode('utf-8') for name in sounds]
+    index_size = sum(1 + len(name) + BANK_ENTRY.size for name in names)
+    offset = BANK_HEADER.size + index_size
+
+    with open(path, 'wb') as f:
+        f.write(BANK_HEADER.pack(BANK_MAGIC, BANK_VERSION, rate, len(sounds)))
+        for name, pcm in zip(names, sounds.values()):
+            f.write(bytes([len(name)]) + name + BANK_ENTRY.pack(offset, len(pcm) // 2))
+            offset += len(pcm)
+        for pcm in sounds.values():
+            f.write(pcm)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a sound pack directory into a PCM sound bank.")
+    parser.add_argument('directory', help="sound pack directory, e.g. assets/sound")
+    parser.add_argument('output', help="bank file to write, e.g. assets/sound/default.bank")
+    parser.add_argument('--rate', type=int, default=44100, help="sample rate to store (use the playback rate)")
+    args = parser.parse_args()
+
+    sounds = load_sounds(args.directory, args.rate)
+    write_bank(args.output, args.rate, sounds)
+    print(f"Wrote {len(sounds)} sounds to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,150 @@
 import pyaudio
 import numpy as np
-import collections
-import asyncio
 import json
+import threading
+import time
+from collections import deque
 from PyQt5.QtCore import QThread
+from devices import device_rate, find_device
+from frames import CODEC_COMFORT_NOISE, audio_level, pack_frame
+from resample import Resampler
+from voice_codec import get_codec
+from vad import VoiceActivityDetector
+
+CAPTURE_RATE = 44100
 
 class AudioThread(QThread):
-    def __init__(self, websocket, loop, push_to_talk=False, vad=False, vad_level=0):
+    def __init__(self, pyaudio_instance, send_queue, push_to_talk=False, vad=False, vad_level=0, codec='pcm16', sample_rate=CAPTURE_RATE,
+                 vad_mode='Volume Gate', dtx=True, frame_ms=20, device=None, capture_rate=0, pre_roll_ms=200):
         super().__init__()
-        self.websocket = websocket
-        self.pyaudio_instance = pyaudio.PyAudio()
+        self.send_queue = send_queue
+        self.codec = get_codec(codec)
+        self.pyaudio_instance = pyaudio_instance
+        # Capture at the device's rate; the resampler converts to the wire rate.
+        device_index = find_device(self.pyaudio_instance, device, input=True)
+        self.capture_rate = device_rate(self.pyaudio_instance, device_index, capture_rate, input=True)
+        self.frame_samples = round(self.capture_rate * frame_ms / 1000)
+        self.resampler = Resampler(self.capture_rate, sample_rate)
         self.stream = self.pyaudio_instance.open(format=pyaudio.paInt16,
                                                  channels=1,
-                                                 rate=44100,
+                                                 rate=self.capture_rate,
                                                  input=True,
-                                                 frames_per_buffer=1024)
+                                                 input_device_index=device_index,
+                                                 frames_per_buffer=self.frame_samples)
         self.running = True
-        self.loop = loop
-        self.talking_threshold = 500
-        self.silence_threshold = 300
-        self.silent_frames = collections.deque(maxlen=self.silence_threshold)
+        self.condition = threading.Condition()
         self.mic_muted = False
         self.push_to_talk = push_to_talk
+        self.ptt_pressed = False
+        self.pre_roll = deque(maxlen=max(1, pre_roll_ms // frame_ms))
         self.vad = vad
         self.vad_level = vad_level
+        self.vad_mode = vad_mode
+        self.dtx = dtx
+        self.frame_ms = frame_ms
+        self.noise_level = None
+        self.detector = self.create_detector(sample_rate)
+        self.talking = False
+        self.transmitting = False
+        self.sequence = 0
+
+    def create_detector(self, sample_rate):
+        # Without VAD activation the detector still drives the talking indicator
+        # and DTX, at the fixed threshold the talking indicator has always used.
+        threshold_db = VoiceActivityDetector.threshold_from_setting(self.vad_level) if self.vad else -40.0
+        band_ratio = 0.5 if self.vad and self.vad_mode == 'Speech Band' else 0.0
+        return VoiceActivityDetector(sample_rate, round(sample_rate * self.frame_ms / 1000), threshold_db, band_ratio=band_ratio)
+
+    def route(self, send_queue, codec, sample_rate):
+        """Send to a new connection or wire format without reopening the device."""
+        if sample_rate != self.resampler.to_rate:
+            self.resampler = Resampler(self.capture_rate, sample_rate)
+            self.detector = self.create_detector(sample_rate)
+        self.codec = get_codec(codec)
+        with self.condition:
+            self.send_queue = send_queue
+            self.condition.notify()
+        if self.talking:
+            send_queue.put(json.dumps({'type': 'talking', 'status': True}))
+
+    def detach(self):
+        """Stop sending after a disconnect; the thread sleeps until route() is called."""
+        with self.condition:
+            self.send_queue = None
+            self.talking = False
+            self.transmitting = False
+            self.pre_roll.clear()
 
     def run(self):
-        talking = False
         while self.running:
-            if not self.mic_muted:
-                data = self.stream.read(1024)
-                audio_level = np.frombuffer(data, dtype=np.int16).max()
-                self.silent_frames.append(audio_level < self.talking_threshold)
+            with self.condition:
+                while self.running and (self.mic_muted or self.send_queue is None):
+                    # Muted or not connected: stop the device and sleep until needed again.
+                    if self.stream.is_active():
+                        self.stream.stop_stream()
+                    self.condition.wait()
+                send_queue = self.send_queue
+            if not self.running:
+                break
+            if not self.stream.is_active():
+                self.stream.start_stream()
+
+            data = self.stream.read(self.frame_samples, exception_on_overflow=False)
+            timestamp = int(time.monotonic() * 1000)
+            samples = np.frombuffer(data, dtype=np.int16)
+            if self.push_to_talk and not self.ptt_pressed:
+                # Key up: only remember the raw audio so pressing the key doesn't clip the first syllable.
+                self.pre_roll.append((timestamp, samples))
+                if self.talking:
+                    self.talking = False
+                    send_queue.put(json.dumps({'type': 'talking', 'status': False}))
+                continue
+            while self.pre_roll:
+                self.process_frame(send_queue, *self.pre_roll.popleft())
+            self.process_frame(send_queue, timestamp, samples)
 
-                if not talking and not any(self.silent_frames):
-                    talking = True
-                    asyncio.run_coroutine_threadsafe(self.websocket.send(json.dumps({'type': 'talking', 'status': True})), self.loop)
+    def process_frame(self, send_queue, timestamp, samples):
+        wire_samples = self.resampler.process(samples)
 
-                if talking and all(self.silent_frames):
-                    talking = False
-                    asyncio.run_coroutine_threadsafe(self.websocket.send(json.dumps({'type': 'talking', 'status': False})), self.loop)
+        if self.detector.process(wire_samples) != self.talking:
+            self.talking = not self.talking
+            send_queue.put(json.dumps({'type': 'talking', 'status': self.talking}))
 
-                asyncio.run_coroutine_threadsafe(self.websocket.send(data), self.loop)
+        level = audio_level(wire_samples)
+        if not self.talking:
+            self.noise_level = level if self.noise_level is None else round(0.9 * self.noise_level + 0.1 * level)
+
+        if self.talking or not self.dtx:
+            frame = pack_frame(self.codec.codec_id, self.sequence, timestamp, level, self.codec.encode(wire_samples))
+        elif self.transmitting:
+            # Hangover is over: send one silence descriptor and stop until speech resumes.
+            frame = pack_frame(CODEC_COMFORT_NOISE, self.sequence, timestamp, self.noise_level, b'')
+        else:
+            return
+        self.transmitting = self.talking or not self.dtx
+        self.sequence += 1
+        send_queue.put(frame)
 
     def mute_mic(self):
-        self.mic_muted = True
+        with self.condition:
+            self.mic_muted = True
 
     def unmute_mic(self):
-        self.mic_muted = False
+        with self.condition:
+            self.mic_muted = False
+            self.condition.notify()
+
+    def press_to_talk(self):
+        self.ptt_pressed = True
+
+    def release_to_talk(self):
+        self.ptt_pressed = False
 
     def stop(self):
-        self.running = False
+        with self.condition:
+            self.running = False
+            self.condition.notify()
         self.wait()
-        self.stream.stop_stream()
+        if self.stream.is_active():
+            self.stream.stop_stream()
         self.stream.close()
-        self.pyaudio_instance.terminate()
@@ -0,0 +1,28 @@
+import pyaudio
+
+def find_device(pyaudio_instance, name, input=True):
+    """Index of the named capture/playback device, or None to use the default."""
+    info = pyaudio_instance.get_host_api_info_by_index(0)
+    for i in range(0, info.get('deviceCount')):
+        device_info = pyaudio_instance.get_device_info_by_host_api_device_index(0, i)
+        channels = device_info.get('maxInputChannels') if input else device_info.get('maxOutputChannels')
+        if channels > 0 and device_info.get('name') == name:
+            return device_info.get('index')
+    return None
+
+def device_rate(pyaudio_instance, index, preferred=0, input=True):
+    """preferred if the device can open mono int16 at that rate, else its default rate."""
+    if index is None:
+        info = pyaudio_instance.get_default_input_device_info() if input else pyaudio_instance.get_default_output_device_info()
+    else:
+        info = pyaudio_instance.get_device_info_by_index(index)
+    if preferred:
+        try:
+            if input:
+                pyaudio_instance.is_format_supported(preferred, input_device=info['index'], input_channels=1, input_format=pyaudio.paInt16)
+            else:
+                pyaudio_instance.is_format_supported(preferred, output_device=info['index'], output_channels=1, output_format=pyaudio.paInt16)
+            return preferred
+        except ValueError:
+            print(f"{info['name']} does not support {preferred} Hz, using {int(info['defaultSampleRate'])} Hz")
+    return int(info['defaultSampleRate'])
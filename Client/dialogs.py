@@ -1,3 +1,5 @@
+import glob
+import os
 import pyaudio
 import wave
 import numpy as np
@@ -28,6 +30,7 @@ from PyQt5.QtWidgets import (
     QStyle,
     QLabel,
     QTabWidget,
+    QSpinBox,
     QInputDialog)
 
 #Connections tab
@@ -235,6 +238,12 @@ class ConnectionInfoDialog(QDialog):
         self.client_info_layout.addRow("Ping:", self.ping_label)
         self.client_address_label = QLabel()
         self.client_info_layout.addRow("Client address:", self.client_address_label)
+        self.jitter_buffer_label = QLabel()
+        self.client_info_layout.addRow("Jitter buffer:", self.jitter_buffer_label)
+        self.send_queue_label = QLabel()
+        self.client_info_layout.addRow("Send queue:", self.send_queue_label)
+        self.playback_label = QLabel()
+        self.client_info_layout.addRow("Playback:", self.playback_label)
         self.layout.addLayout(self.client_info_layout)
         
         self.tab_widget = QTabWidget()
@@ -344,6 +353,9 @@ class ConnectionInfoDialog(QDialog):
         self.idle_time_label.setText(info.get('idle_time', ''))
         self.ping_label.setText(info.get('ping', ''))
         self.client_address_label.setText(info.get('client_address', ''))
+        self.jitter_buffer_label.setText(info.get('jitter_buffer', ''))
+        self.send_queue_label.setText(info.get('send_queue', ''))
+        self.playback_label.setText(info.get('playback', ''))
 
         # Update total tab
         total_info = info.get('total', {})
@@ -485,6 +497,9 @@ class SettingsDialog(QDialog):
         self.populate_audio_devices(self.playback_device_combo, input=False)
         form_layout.addRow("Playback Device:", self.playback_device_combo)
 
+        self.playback_rate_combo = self.create_rate_combo()
+        form_layout.addRow("Sample Rate:", self.playback_rate_combo)
+
         layout.addLayout(form_layout)
 
         # Sliders
@@ -500,6 +515,20 @@ class SettingsDialog(QDialog):
         self.sound_pack_volume_slider.valueChanged.connect(self.update_sound_pack_volume)
         form_layout.addRow("Sound Pack Volume:", self.sound_pack_volume_slider)
 
+        # Compiled sound packs, see Utils/build_sound_bank.py
+        self.sound_bank_combo = QComboBox()
+        self.sound_bank_combo.addItem("Default (sound files)", "")
+        for bank_path in sorted(glob.glob('assets/sound/*.bank')):
+            self.sound_bank_combo.addItem(os.path.splitext(os.path.basename(bank_path))[0], bank_path)
+        form_layout.addRow("Sound Pack:", self.sound_bank_combo)
+
+        self.jitter_buffer_spin = QSpinBox()
+        self.jitter_buffer_spin.setRange(20, 400)
+        self.jitter_buffer_spin.setSingleStep(10)
+        self.jitter_buffer_spin.setSuffix(" ms")
+        self.jitter_buffer_spin.setValue(60)
+        form_layout.addRow("Playout Delay:", self.jitter_buffer_spin)
+
         layout.addLayout(form_layout)
 
         # Play test sound button
@@ -551,6 +580,15 @@ class SettingsDialog(QDialog):
         self.populate_audio_devices(self.capture_device_combo, input=True)
         form_layout.addRow("Capture Device:", self.capture_device_combo)
 
+        self.capture_rate_combo = self.create_rate_combo()
+        form_layout.addRow("Sample Rate:", self.capture_rate_combo)
+
+        self.frame_size_combo = QComboBox()
+        for frame_ms in (10, 20, 40):
+            self.frame_size_combo.addItem(f"{frame_ms} ms", frame_ms)
+        self.frame_size_combo.setCurrentIndex(1)
+        form_layout.addRow("Frame Size:", self.frame_size_combo)
+
         layout.addLayout(form_layout)
 
         # Activation section
@@ -575,7 +613,7 @@ class SettingsDialog(QDialog):
         vad_layout = QHBoxLayout()
         vad_layout.addWidget(self.vad_radio)
         self.vad_mode_combo = QComboBox()
-        self.vad_mode_combo.addItems(["Volume Gate"])
+        self.vad_mode_combo.addItems(["Volume Gate", "Speech Band"])
         vad_layout.addWidget(self.vad_mode_combo)
         activation_layout.addLayout(vad_layout)
 
@@ -615,6 +653,10 @@ class SettingsDialog(QDialog):
         self.echo_reduction_checkbox = QCheckBox("Echo reduction (Ducking)")
         dsp_layout.addWidget(self.echo_reduction_checkbox)
 
+        self.dtx_checkbox = QCheckBox("Stop transmitting during silence (DTX)")
+        self.dtx_checkbox.setChecked(True)
+        dsp_layout.addWidget(self.dtx_checkbox)
+
         dsp_group.setLayout(dsp_layout)
         layout.addWidget(dsp_group)
 
@@ -623,6 +665,13 @@ class SettingsDialog(QDialog):
         return page
 
 
+    def create_rate_combo(self):
+        combo_box = QComboBox()
+        combo_box.addItem("Device default", 0)
+        for rate in (16000, 24000, 44100, 48000):
+            combo_box.addItem(f"{rate} Hz", rate)
+        return combo_box
+
     def populate_audio_devices(self, combo_box, input=True):
         p = pyaudio.PyAudio()
         info = p.get_host_api_info_by_index(0)
@@ -651,6 +700,8 @@ class SettingsDialog(QDialog):
             self.hotkey_button.setEnabled(False)
             self.vad_slider.setEnabled(True)
             self.begin_test_button.setEnabled(True)
+        # Continuous transmission never stops sending, so DTX does not apply.
+        self.dtx_checkbox.setEnabled(not self.continuous_transmission_radio.isChecked())
 
     def assign_hotkey(self):
         hotkey, ok = QInputDialog.getText(self, 'Assign Hotkey', 'Press the key you want to assign as Push-to-Talk hotkey:')
@@ -757,8 +808,11 @@ class SettingsDialog(QDialog):
         settings = {
             "playback_mode": self.playback_mode_combo.currentText(),
             "playback_device": self.playback_device_combo.currentText(),
+            "playback_rate": self.playback_rate_combo.currentData(),
             "volume_adjustment": self.volume_adjustment_slider.value(),
             "sound_pack_volume": self.sound_pack_volume_slider.value(),
+            "sound_bank": self.sound_bank_combo.currentData(),
+            "jitter_buffer_ms": self.jitter_buffer_spin.value(),
             "auto_volume": self.auto_volume_checkbox.isChecked(),
             "mic_clicks": self.mic_clicks_checkbox.isChecked(),
             "mono_stereo": self.mono_stereo_radio.isChecked(),
@@ -766,6 +820,8 @@ class SettingsDialog(QDialog):
             "mono_surround": self.mono_surround_radio.isChecked(),
             "capture_mode": self.capture_mode_combo.currentText(),
             "capture_device": self.capture_device_combo.currentText(),
+            "capture_rate": self.capture_rate_combo.currentData(),
+            "frame_ms": self.frame_size_combo.currentData(),
             "push_to_talk": self.push_to_talk_radio.isChecked(),
             "continuous_transmission": self.continuous_transmission_radio.isChecked(),
             "vad": self.vad_radio.isChecked(),
@@ -775,6 +831,7 @@ class SettingsDialog(QDialog):
             "remove_noise": self.remove_noise_checkbox.isChecked(),
             "echo_cancel": self.echo_cancel_checkbox.isChecked(),
             "echo_reduction": self.echo_reduction_checkbox.isChecked(),
+            "dtx": self.dtx_checkbox.isChecked(),
             "hotkey": self.hotkey_button.text()
         }
 
@@ -787,8 +844,11 @@ class SettingsDialog(QDialog):
             
             self.playback_mode_combo.setCurrentText(settings.get("playback_mode", "Automatically use best mode"))
             self.playback_device_combo.setCurrentText(settings.get("playback_device", "Default"))
+            self.playback_rate_combo.setCurrentIndex(max(0, self.playback_rate_combo.findData(settings.get("playback_rate", 0))))
             self.volume_adjustment_slider.setValue(settings.get("volume_adjustment", 0))
             self.sound_pack_volume_slider.setValue(settings.get("sound_pack_volume", 50))
+            self.sound_bank_combo.setCurrentIndex(max(0, self.sound_bank_combo.findData(settings.get("sound_bank", ""))))
+            self.jitter_buffer_spin.setValue(settings.get("jitter_buffer_ms", 60))
             self.auto_volume_checkbox.setChecked(settings.get("auto_volume", False))
             self.mic_clicks_checkbox.setChecked(settings.get("mic_clicks", False))
             self.mono_stereo_radio.setChecked(settings.get("mono_stereo", True))
@@ -796,6 +856,8 @@ class SettingsDialog(QDialog):
             self.mono_surround_radio.setChecked(settings.get("mono_surround", False))
             self.capture_mode_combo.setCurrentText(settings.get("capture_mode", "Automatically use best mode"))
             self.capture_device_combo.setCurrentText(settings.get("capture_device", "Default"))
+            self.capture_rate_combo.setCurrentIndex(max(0, self.capture_rate_combo.findData(settings.get("capture_rate", 0))))
+            self.frame_size_combo.setCurrentIndex(max(0, self.frame_size_combo.findData(settings.get("frame_ms", 20))))
             self.push_to_talk_radio.setChecked(settings.get("push_to_talk", False))
             self.continuous_transmission_radio.setChecked(settings.get("continuous_transmission", False))
             self.vad_radio.setChecked(settings.get("vad", False))
@@ -805,6 +867,7 @@ class SettingsDialog(QDialog):
             self.remove_noise_checkbox.setChecked(settings.get("remove_noise", True))
             self.echo_cancel_checkbox.setChecked(settings.get("echo_cancel", True))
             self.echo_reduction_checkbox.setChecked(settings.get("echo_reduction", False))
+            self.dtx_checkbox.setChecked(settings.get("dtx", True))
             
             self.hotkey_button.setText(settings.get("hotkey", "No Hotkey Assigned"))
             
@@ -1,20 +1,29 @@
 import asyncio
 import json
+import logging
 import threading
+import time
 import pyaudio
 import websockets
 import webbrowser
 import sqlite3
 import uuid
 from pynput import keyboard
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from audio import AudioThread
+from devices import device_rate, find_device
+from frames import CODEC_COMFORT_NOISE, MIX_SPEAKER, unpack_frame
+from jitter import JitterBuffer
+from playback import COMFORT_NOISE_SECONDS, PLAYBACK_RATE, PlaybackStream, VoiceMixer
+from resample import Resampler
+from sender import SendQueue
+from sounds import NOTIFICATION_SOUNDS, SoundCache
+from voice_codec import SUPPORTED_CODECS, codec_by_id
 
 #PyQt imports
-from PyQt5.QtMultimedia import QMediaPlayer,QMediaContent
 from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QListWidget, QListWidgetItem, QPushButton, QTextEdit, QLineEdit, QAction, QSplitter, QDialog, QLabel, QMenu, QInputDialog, QMessageBox
-from PyQt5.QtGui import QIcon, QPixmap
-from PyQt5.QtCore import Qt, QUrl, QSize
+from PyQt5.QtGui import QIcon, QPixmap, QTextCursor
+from PyQt5.QtCore import Qt, QSize
 
 #Local imports
 from dialogs import (
@@ -51,10 +60,10 @@ class VoiceChatClient(QMainWindow):
         self.connection_start_time = None 
         self.ping = 0
         self.voice_volume = 0 
-        self.sound_pack_volume = 0 
         self.load_bookmarks_from_db()
         self.refresh_bookmarks_menu()
         self.settings = load_settings_from_db()
+        self.sound_pack_volume = self.settings.get('sound_pack_volume', 50)
         self.current_identity = load_default_identity()
         self.changelog_file = 'changelog.txt'
         self.PyLicense = 'assets/Pylicense.ini'
@@ -65,11 +74,31 @@ class VoiceChatClient(QMainWindow):
         self.stream = None
         self.mic_muted = False
         self.speaker_muted = False
-        self.audio_stream = None
+        self.playback = None
         self.audio_thread = None
+        self.send_queue = None
         self.lock = threading.Lock()
-
-        self.media_player = QMediaPlayer()
+        self.speaker_slots = {}  # speaker slot -> username, from room_update
+        self.push_to_talk_hotkey = None
+        self.listener = None  # pynput keyboard listener for the push-to-talk hotkey
+        self.audio_format = {'codec': 'pcm16', 'sample_rate': 44100}
+        self.playback_rate = PLAYBACK_RATE
+        self.playback_resamplers = {}  # speaker slot -> Resampler to the output rate
+        self.jitter_buffers = {}  # speaker slot -> JitterBuffer
+        self.voice_mixer = VoiceMixer()
+        self.user_volumes = {}  # username -> volume adjustment in dB
+        self.locally_muted = set()  # usernames
+        self.room_list = {}  # room name -> {'members': [usernames], 'password': ...}
+        self.room_list_seq = None  # seq of the last room list event applied, None until a snapshot arrives
+        self.history_anchor = None  # console position older history pages are inserted at
+        self.history_oldest_id = None
+        self.history_more = False
+        self.history_loading = False
+
+        self.playout_task = None
+        self.sound_cache = SoundCache(self.playback_rate)
+        self.sound_cache.load_bank(self.settings.get('sound_bank', ''))
+        self.sound_cache.preload(NOTIFICATION_SOUNDS)
 
         # Initialize statistics
         self.statistics = {
@@ -223,6 +252,7 @@ class VoiceChatClient(QMainWindow):
 
         self.console = QTextEdit()
         self.console.setReadOnly(True)
+        self.console.verticalScrollBar().valueChanged.connect(self.on_console_scrolled)
         splitter_bottom.addWidget(self.console)
 
         message_input_widget = QWidget()
@@ -271,80 +301,151 @@ class VoiceChatClient(QMainWindow):
 
     def mute_speaker(self):
         self.speaker_muted = True
+        self.voice_mixer.deafened = True
         self.log_message("Speaker muted")
 
     def unmute_speaker(self):
         self.speaker_muted = False
+        self.voice_mixer.deafened = False
         self.log_message("Speaker unmuted")
 
     def set_voice_volume(self, value):
         self.voice_volume = value
+        self.voice_mixer.master_gain = VoiceMixer.gain_from_db(value)
+
+    def apply_speaker_gains(self):
+        self.voice_mixer.gains = {slot: VoiceMixer.gain_from_db(self.user_volumes[username])
+                                  for slot, username in self.speaker_slots.items() if username in self.user_volumes}
+        self.voice_mixer.muted = {slot for slot, username in self.speaker_slots.items() if username in self.locally_muted}
+
+    def set_user_volume(self, username):
+        volume, ok = QInputDialog.getInt(self, 'Set Volume', f'Volume adjustment for {username} (dB):',
+                                         self.user_volumes.get(username, 0), -40, 20)
+        if ok:
+            self.user_volumes[username] = volume
+            self.apply_speaker_gains()
+
+    def toggle_local_mute(self, username):
+        if username in self.locally_muted:
+            self.locally_muted.discard(username)
+        else:
+            self.locally_muted.add(username)
+        self.apply_speaker_gains()
 
     def set_sound_pack_volume(self, value):
         self.sound_pack_volume = value
-        self.media_player.setVolume(int(value))
 
     def reset_audio_stream(self):
-        if self.audio_stream is not None:
+        if self.playback is not None:
             try:
-                self.audio_stream.close()
+                self.playback.close()
             except OSError as e:
                 print(f"Error closing stream: {e}")
+            self.playback = None
         try:
-            self.audio_stream = self.pyaudio_instance.open(format=pyaudio.paInt16,
-                                                           channels=1,
-                                                           rate=44100,
-                                                           output=True)
+            device_index = find_device(self.pyaudio_instance, self.settings.get('playback_device'), input=False)
+            self.playback_rate = device_rate(self.pyaudio_instance, device_index, self.settings.get('playback_rate', 0), input=False)
+            self.playback = PlaybackStream(self.pyaudio_instance, self.playback_rate, device_index=device_index)
+            self.sound_cache.set_rate(self.playback_rate)
         except OSError as e:
             print(f"Error opening stream: {e}")
 
-    def play_audio(self, audio_data):
-        if not self.speaker_muted and self.audio_stream is not None:
-            try:
-                self.audio_stream.write(audio_data)
-            except OSError as e:
-                if e.errno == -9983:  # Stream is stopped
-                    self.reset_audio_stream()
-                    try:
-                        self.audio_stream.write(audio_data)
-                    except OSError as inner_e:
-                        print(f"Error writing to stream: {inner_e}")
+    def decode_audio(self, header, payload):
+        codec = codec_by_id(header.codec)
+        if codec is None:
+            return None
+        resampler = self.playback_resamplers.get(header.speaker)
+        if resampler is None or resampler.from_rate != self.audio_format['sample_rate'] or resampler.to_rate != self.playback_rate:
+            resampler = self.playback_resamplers[header.speaker] = Resampler(self.audio_format['sample_rate'], self.playback_rate)
+        return resampler.process(codec.decode(payload))
+
+    def play_audio(self, samples):
+        """Queue samples for the playback callback; never blocks on the device."""
+        if self.playback is None:
+            self.reset_audio_stream()
+        if self.playback is not None:
+            self.playback.write(samples)
 
     def start_audio_stream(self):
         push_to_talk = self.settings.get('push_to_talk', False)
+        if push_to_talk:
+            hotkey = self.settings.get('hotkey')
+            if hotkey and hotkey != "No Hotkey Assigned":
+                self.set_push_to_talk_hotkey(hotkey)
+            else:
+                # Without a key the user could never transmit; keep the mic open instead.
+                push_to_talk = False
+                self.log_message("Push-to-talk has no hotkey assigned; transmitting without it")
         vad = self.settings.get('vad', False)
         vad_level = self.settings.get('vad_level', 0)
+        vad_mode = self.settings.get('vad_mode', 'Volume Gate')
+        dtx = self.settings.get('dtx', True) and not self.settings.get('continuous_transmission', False)
         
-        self.audio_thread = AudioThread(self.websocket, asyncio.get_event_loop(), push_to_talk, vad, vad_level)
+        self.audio_thread = AudioThread(self.pyaudio_instance, self.send_queue, push_to_talk, vad, vad_level,
+                                        self.audio_format['codec'], self.audio_format['sample_rate'], vad_mode, dtx,
+                                        self.settings.get('frame_ms', 20), self.settings.get('capture_device'),
+                                        self.settings.get('capture_rate', 0))
+        if self.muteMicButton.isChecked():
+            # A restarted capture thread must not go live behind a muted button.
+            self.audio_thread.mute_mic()
         self.audio_thread.start()
 
+    def route_audio_stream(self):
+        """Point capture at the current connection, starting it if it is not running yet."""
+        if self.audio_thread is None:
+            self.start_audio_stream()
+        else:
+            self.audio_thread.route(self.send_queue, self.audio_format['codec'], self.audio_format['sample_rate'])
+
+    def forget_speakers(self, speaker_slots):
+        """Drop playout state of slots that were freed or handed to another speaker.
+
+        Slots new to us are kept: a new speaker's first frames may arrive
+        before the room_update that announces them.
+        """
+        for slot in list(self.jitter_buffers):
+            if slot != MIX_SPEAKER and slot in self.speaker_slots and self.speaker_slots[slot] != speaker_slots.get(slot):
+                self.jitter_buffers.pop(slot, None)
+                self.playback_resamplers.pop(slot, None)
+
+    def reset_voice_routing(self):
+        """Forget per-speaker playout state; the output stream itself stays open."""
+        self.jitter_buffers.clear()
+        self.playback_resamplers.clear()
+        self.voice_mixer.clear()
+
     def stop_audio_stream(self):
         if self.audio_thread:
             self.audio_thread.stop()
             self.audio_thread = None
 
     def play_sound(self, sound_file):
-        self.media_player.setMedia(QMediaContent(QUrl.fromLocalFile(sound_file)))
-        self.media_player.setVolume(int(self.sound_pack_volume))  # Konvertera till int för setVolume
-        self.media_player.play()
+        if self.playback is None:
+            self.reset_audio_stream()
+        self.sound_cache.load(sound_file, self.queue_sound)
+
+    def queue_sound(self, samples):
+        self.voice_mixer.play_effect(samples, int(self.sound_pack_volume) * VoiceMixer.UNITY // 100)
+        self.ensure_playout()
 
     #push to talk funktion
     def set_push_to_talk_hotkey(self, hotkey):
         self.push_to_talk_hotkey = hotkey
-        self.listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
-        self.listener.start()
+        if self.listener is None:
+            self.listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
+            self.listener.start()
 
     def on_press(self, key):
         try:
-            if key.char == self.push_to_talk_hotkey:
-                self.audio_thread.unmute_mic()
+            if key.char == self.push_to_talk_hotkey and self.audio_thread is not None:
+                self.audio_thread.press_to_talk()
         except AttributeError:
             pass
 
     def on_release(self, key):
         try:
-            if key.char == self.push_to_talk_hotkey:
-                self.audio_thread.mute_mic()
+            if key.char == self.push_to_talk_hotkey and self.audio_thread is not None:
+                self.audio_thread.release_to_talk()
         except AttributeError:
             pass
 
@@ -436,7 +537,16 @@ class VoiceChatClient(QMainWindow):
     #To show settings window
     def show_settings_dialog(self):
         dialog = SettingsDialog(self)
-        dialog.exec_()
+        if dialog.exec_() == QDialog.Accepted:
+            self.settings = load_settings_from_db()
+            self.sound_cache.load_bank(self.settings.get('sound_bank', ''))
+            self.sound_cache.preload(NOTIFICATION_SOUNDS)
+            # Reopen the devices with the new device, rate and frame size.
+            if self.playback is not None:
+                self.reset_audio_stream()
+            if self.audio_thread is not None:
+                self.stop_audio_stream()
+                self.start_audio_stream()
 
     #Show use PrivilegeKey window
     def show_use_privilege_key_dialog(self):
@@ -480,7 +590,7 @@ class VoiceChatClient(QMainWindow):
         try:
             self.log_message(f"Trying to connect to server on {server_address}")
             self.websocket = await websockets.connect(f'ws://{server_address}')
-            await self.websocket.send(json.dumps({'type': 'join', 'username': name, 'password': password, 'uid': uid}))
+            await self.websocket.send(json.dumps({'type': 'join', 'username': name, 'password': password, 'uid': uid, 'codecs': SUPPORTED_CODECS}))
             self.log_message(f"Connected to {server_address} as {name}")
             self.current_username = name
             self.current_uid = uid  # Spara UID
@@ -490,14 +600,23 @@ class VoiceChatClient(QMainWindow):
             self.update_bookmark_actions()
             self.play_sound('assets/sound/connected.mp3')
 
+            self.send_queue = SendQueue(self.websocket, asyncio.get_event_loop())
+            asyncio.ensure_future(self.send_queue.run())
             asyncio.ensure_future(self.receive_messages())
         except Exception as e:
             self.log_message(f"Failed to connect: {str(e)}")
 
     async def disconnect_from_server(self):
         if self.websocket:
+            self.send_queue.close()
+            self.send_queue = None
+            if self.audio_thread is not None:
+                # Keep the device open for a quick reconnect, but stop capturing.
+                self.audio_thread.detach()
             await self.websocket.close()
             self.websocket = None
+            self.reset_voice_routing()
+            self.room_list_seq = None
             self.connectionInfoAction.setEnabled(False)
             self.log_message("Disconnected from server")
             self.play_sound('assets/sound/disconnected.mp3')
@@ -509,7 +628,18 @@ class VoiceChatClient(QMainWindow):
         try:
             async for message in self.websocket:
                 if isinstance(message, bytes):
-                    self.play_audio(message)
+                    try:
+                        header, payload = unpack_frame(message)
+                    except ValueError as e:
+                        # Debug only: a version mismatch would hit this for every frame.
+                        logging.debug(f"Dropping audio frame: {e}")
+                        continue
+                    jitter_buffer = self.jitter_buffers.get(header.speaker)
+                    if jitter_buffer is None:
+                        jitter_buffer = JitterBuffer(self.settings.get('jitter_buffer_ms', 60))
+                        self.jitter_buffers[header.speaker] = jitter_buffer
+                    jitter_buffer.push(header, bytes(payload))
+                    self.ensure_playout()
                     self.update_statistics("speech", len(message))
                 else:
                     data = json.loads(message)
@@ -521,24 +651,88 @@ class VoiceChatClient(QMainWindow):
                         self.log_message(f"{data['username']}: {data['message']}")
                     #elif data['type'] == 'room_update':
                         #self.update_room_members(data['members'])
+                    elif data['type'] == 'room_update':
+                        speaker_slots = {member['slot']: member['username'] for member in data['members']}
+                        self.forget_speakers(speaker_slots)
+                        self.speaker_slots = speaker_slots
+                        self.voice_mixer.forget(self.speaker_slots)
+                        self.apply_speaker_gains()
+                    elif data['type'] == 'history':
+                        self.show_history(data)
                     elif data['type'] == 'room_list':
                         self.update_room_list(data)
+                    elif data['type'] == 'room_events':
+                        for event in data['events']:
+                            if not self.apply_room_event(event):
+                                break
+                        self.render_room_list()
                     elif data['type'] == 'error':
                         self.log_message(f"Error: {data['message']}")
                     elif data['type'] == 'talking':
                         self.handle_talking(data['username'], data['status'])
                     elif data['type'] == 'ping':
                         self.ping = data['ping']
+                    elif data['type'] == 'audio_format':
+                        self.audio_format = {'codec': data['codec'], 'sample_rate': data['sample_rate']}
+                        self.log_message(f"Voice codec: {data['codec']} at {data['sample_rate']} Hz")
+                        if self.playback is None:
+                            self.reset_audio_stream()
+                        self.route_audio_stream()
                     elif data['type'] == 'switched_room':
                         self.log_message(data['message'])
-                        self.stop_audio_stream()  # Stop the current audio stream
-                        self.start_audio_stream()  # Start a new audio stream for the new room
+                        self.reset_voice_routing()
                         self.play_sound('assets/sound/channel_switched.mp3')
                     self.update_statistics(data['type'], len(message))
         except websockets.ConnectionClosed:
             self.play_sound('assets/sound/connection_lost.mp3')
             self.log_message("Connection closed")
 
+    def ensure_playout(self):
+        if self.playout_task is None or self.playout_task.done():
+            self.playout_task = asyncio.ensure_future(self.playout_loop())
+
+    async def playout_loop(self, interval=0.005, output_ms=30):
+        """Mix due frames from every speaker's jitter buffer into the output.
+
+        The output ring is kept about output_ms full; frames are released
+        that much early so they still reach the speaker on schedule. The
+        loop ends once no talk spurt, comfort noise or sound is left and is
+        restarted by ensure_playout() when there is something to play.
+        """
+        while self.voice_mixer.active() or any(jitter_buffer.next_seq is not None for jitter_buffer in self.jitter_buffers.values()):
+            target_fill = self.playback_rate * output_ms // 1000
+            now = time.monotonic() * 1000 + output_ms
+            for slot, jitter_buffer in list(self.jitter_buffers.items()):
+                for header, payload in jitter_buffer.pop(now):
+                    if header.codec == CODEC_COMFORT_NOISE:
+                        self.voice_mixer.set_comfort_noise(slot, header.level, self.playback_rate * COMFORT_NOISE_SECONDS)
+                        continue
+                    samples = self.decode_audio(header, payload)
+                    if samples is not None:
+                        self.voice_mixer.add(slot, samples)
+
+            buffered = self.playback.ring.available() if self.playback is not None else 0
+            if self.voice_mixer.comfort_noise:
+                count = target_fill - buffered
+            else:
+                count = min(target_fill - buffered, self.voice_mixer.pending_samples())
+            if count > 0:
+                self.play_audio(self.voice_mixer.mix(count))
+            await asyncio.sleep(interval)
+
+    def jitter_statistics(self):
+        stats = [jitter_buffer.stats() for jitter_buffer in self.jitter_buffers.values()]
+        received = sum(jitter_buffer.received for jitter_buffer in self.jitter_buffers.values())
+        lost = sum(s['lost'] for s in stats)
+        return {
+            'depth_ms': max((s['depth_ms'] for s in stats), default=0),
+            'target_ms': max((s['target_ms'] for s in stats), default=0),
+            'jitter_ms': max((s['jitter_ms'] for s in stats), default=0.0),
+            'late': sum(s['late'] for s in stats),
+            'lost': lost,
+            'loss': lost / (received + lost) if received + lost else 0.0,
+        }
+
     def get_uid_for_user(self, nickname):
         conn = sqlite3.connect(db_file)
         cursor = conn.cursor()
@@ -559,14 +753,20 @@ class VoiceChatClient(QMainWindow):
     def get_connection_info(self):
         if self.websocket:
             connection_time = str(timedelta(seconds=int((datetime.now() - self.connection_start_time).total_seconds())))
+            jitter = self.jitter_statistics()
+            sending = self.send_queue.stats()
+            playing = self.playback.stats() if self.playback is not None else None
             return {
                 "client_name": self.current_username or "",
                 "connection_time": connection_time or "",
                 "idle_time": connection_time,  # Assuming no separate idle tracking for now
-                "ping": f"{self.ping} ms ± 0.6",  # Replace 0.6 with actual jitter if available
+                "ping": f"{self.ping} ms ± {jitter['jitter_ms']}",
+                "jitter_buffer": f"{jitter['depth_ms']} ms (target {jitter['target_ms']} ms), {jitter['late']} late, {jitter['lost']} lost",
+                "send_queue": f"{sending['latency_ms']} ms (max {sending['max_latency_ms']} ms), {sending['queued']} queued",
+                "playback": f"{playing['buffered_ms']} ms buffered, {playing['underruns']} underruns, {playing['overflows']} overflows" if playing else "",
                 "client_address":  self.websocket.remote_address[0] if self.websocket.remote_address else "",  # Replace with actual client address
                 "total": {
-                    "packet_loss": "0.00",  # Replace with actual value
+                    "packet_loss": f"{jitter['loss'] * 100:.2f}",
                     "packets_transferred": self.statistics["total"]["packets_transferred"],
                     "bytes_transferred": f"{self.statistics['total']['bytes_transferred'] / 1024:.2f} KiB",
                     "bandwidth_last_second": f"{self.statistics['total']['bandwidth_last_second']} Bytes/s",
@@ -634,7 +834,43 @@ class VoiceChatClient(QMainWindow):
 
     def update_room_list(self, data):
         self.room_list = data['rooms']
+        self.room_list_seq = data.get('seq')
         self.server_name = data.get('server_name', 'Unknown Server')
+        self.render_room_list()
+
+    def apply_room_event(self, event):
+        """Apply one incremental room list change.
+
+        Returns False if a change was missed; a fresh snapshot has then been
+        requested and the rest of the batch should be skipped.
+        """
+        if self.room_list_seq is None or event['seq'] <= self.room_list_seq:
+            return True  # Already covered by the snapshot we have or are waiting for.
+        if event['seq'] != self.room_list_seq + 1:
+            self.room_list_seq = None
+            asyncio.ensure_future(self.websocket.send(json.dumps({'type': 'room_list_resync'})))
+            return False
+        self.room_list_seq = event['seq']
+
+        if event['type'] == 'user_joined':
+            self.room_list.setdefault(event['room'], {'members': [], 'password': None})['members'].append(event['username'])
+        elif event['type'] == 'user_left':
+            self.remove_room_member(event['room'], event['username'])
+        elif event['type'] == 'user_moved':
+            self.remove_room_member(event['from'], event['username'])
+            self.room_list.setdefault(event['to'], {'members': [], 'password': None})['members'].append(event['username'])
+        elif event['type'] in ('room_created', 'room_updated'):
+            self.room_list.setdefault(event['room'], {'members': [], 'password': None})['password'] = event['password']
+        elif event['type'] == 'room_deleted':
+            self.room_list.pop(event['room'], None)
+        return True
+
+    def remove_room_member(self, room_name, username):
+        members = self.room_list.get(room_name, {}).get('members', [])
+        if username in members:
+            members.remove(username)
+
+    def render_room_list(self):
         self.roomList.clear()
 
         # Lägg till servernamn högst upp
@@ -714,6 +950,15 @@ class VoiceChatClient(QMainWindow):
             menu.addAction(kick_action)
             menu.addAction(ban_action)
             menu.addAction(move_action)
+            menu.addSeparator()
+
+            username = item.text().strip()
+            volume_action = QAction('Set Volume', self)
+            volume_action.triggered.connect(lambda: self.set_user_volume(username))
+            local_mute_action = QAction('Unmute Locally' if username in self.locally_muted else 'Mute Locally', self)
+            local_mute_action.triggered.connect(lambda: self.toggle_local_mute(username))
+            menu.addAction(volume_action)
+            menu.addAction(local_mute_action)
 
         menu.exec_(self.roomList.viewport().mapToGlobal(position))
 
@@ -760,6 +1005,39 @@ class VoiceChatClient(QMainWindow):
             self.messageInput.clear()
 
     #log messages
+    def show_history(self, data):
+        """Show a page of chat history: a room's recent messages on join, older pages above them."""
+        lines = [self.format_history_message(message) for message in data['messages']]
+        if self.history_loading and self.history_anchor is not None:
+            if lines:
+                # The anchor keeps its position, so the next older page goes above this one.
+                QTextCursor(self.history_anchor).insertText('\n' + '\n'.join(lines))
+        else:
+            self.log_message(f"Recent messages in {data['room']}:")
+            self.history_anchor = QTextCursor(self.console.document())
+            self.history_anchor.movePosition(QTextCursor.End)
+            self.history_anchor.setKeepPositionOnInsert(True)
+            for line in lines:
+                self.console.append(line)
+            self.history_oldest_id = None
+        if data['messages']:
+            self.history_oldest_id = data['messages'][0]['id']
+        self.history_more = data['more']
+        self.history_loading = False
+
+    def format_history_message(self, message):
+        sent = datetime.strptime(message['timestamp'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).astimezone()
+        return f"{sent.strftime('%H:%M:%S')} - {message['username'] or 'unknown'}: {message['message']}"
+
+    def on_console_scrolled(self, value):
+        # Scrolling to the top of the console loads the page before the oldest message shown.
+        if value != self.console.verticalScrollBar().minimum() or not self.history_more or self.history_loading:
+            return
+        if self.websocket is None or self.history_oldest_id is None:
+            return
+        self.history_loading = True
+        asyncio.ensure_future(self.websocket.send(json.dumps({'type': 'history', 'before': self.history_oldest_id})))
+
     def log_message(self, message):
         timestamp = datetime.now().strftime('%H:%M:%S')
         self.console.append(f"{timestamp} - {message}")
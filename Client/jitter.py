@@ -0,0 +1,132 @@
+import time
+
+def seq_diff(a, b):
+    """a - b for 16-bit sequence numbers that wrap."""
+    return ((a - b + 32768) & 0xFFFF) - 32768
+
+def ts_diff(a, b):
+    """a - b for 32-bit millisecond timestamps that wrap."""
+    return ((a - b + 2 ** 31) & 0xFFFFFFFF) - 2 ** 31
+
+class JitterBuffer:
+    """Adaptive playout buffer for one speaker.
+
+    Frames are kept by sequence number and released in order once their
+    capture timestamp plus the playout offset has passed. The offset starts
+    at target_ms after the first arrival of a talk spurt and follows the
+    measured interarrival jitter (RFC 3550): it grows when frames arrive
+    too late and shrinks when the buffer holds more than it needs.
+    Until a spurt starts playing, a newer frame may pull the offset in, so
+    a burst of frames captured before sending began (push-to-talk
+    pre-roll) plays right away instead of making the buffer look too deep.
+    A sequence jump of more than MAX_SEQ_JUMP frames means the slot now
+    carries a different sender, and the buffer starts over.
+    """
+
+    MAX_SEQ_JUMP = 100
+
+    def __init__(self, target_ms=60, min_ms=20, max_ms=400, clock=None):
+        self.base_target_ms = target_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.clock = clock or (lambda: time.monotonic() * 1000)
+        self.received = 0
+        self.late = 0
+        self.lost = 0
+        self.restart()
+
+    def restart(self):
+        """Forget the stream being played; the counters are kept."""
+        self.frames = {}  # sequence -> (header, payload)
+        self.offset = None  # playout time = capture timestamp + offset
+        self.next_seq = None
+        self.playing = False  # has the current talk spurt started playing
+        self.frame_ms = 20
+        self.jitter = 0.0
+        self.last_transit = None
+        self.last_header = None
+
+    @property
+    def target_ms(self):
+        return min(self.max_ms, max(self.min_ms, self.base_target_ms, 3 * self.jitter + self.frame_ms))
+
+    def depth_ms(self, now=None):
+        """Milliseconds of audio buffered ahead of the playout point."""
+        if not self.frames:
+            return 0
+        now = self.clock() if now is None else now
+        return max(0, self.last_header.timestamp + self.offset + self.frame_ms - now)
+
+    def push(self, header, payload):
+        now = self.clock()
+        self.received += 1
+
+        if self.last_header is not None and abs(seq_diff(header.sequence, self.last_header.sequence)) > self.MAX_SEQ_JUMP:
+            self.restart()
+        elif self.next_seq is None:
+            # New talk spurt: the last frame seen belongs to the previous one.
+            self.last_header = None
+
+        transit = now - header.timestamp
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+
+        if self.last_header is not None:
+            steps = seq_diff(header.sequence, self.last_header.sequence)
+            if 0 < steps < 10:
+                self.frame_ms = max(1, ts_diff(header.timestamp, self.last_header.timestamp) / steps)
+        if self.last_header is None or seq_diff(header.sequence, self.last_header.sequence) > 0:
+            self.last_header = header
+
+        if self.next_seq is None:
+            # Start of a talk spurt: schedule it target_ms from now.
+            self.next_seq = header.sequence
+            self.offset = now - header.timestamp + self.target_ms
+            self.playing = False
+        elif seq_diff(header.sequence, self.next_seq) < 0:
+            self.late += 1
+            # Arrivals after their playout time mean the delay is too short.
+            self.offset = min(self.offset + self.frame_ms, now - header.timestamp + self.max_ms)
+            return
+        elif not self.playing:
+            # Frames sent in a burst: schedule from the newest, the older ones are already late.
+            self.offset = min(self.offset, now - header.timestamp + self.target_ms)
+
+        self.frames[header.sequence] = (header, payload)
+
+    def pop(self, now=None):
+        """Return the (header, payload) frames due for playout, in order."""
+        now = self.clock() if now is None else now
+        due = []
+        while self.frames:
+            frame = self.frames.get(self.next_seq)
+            if frame is None:
+                # Skip a gap only once a later frame is due, otherwise it may still arrive.
+                oldest = min(self.frames, key=lambda seq: seq_diff(seq, self.next_seq))
+                if self.frames[oldest][0].timestamp + self.offset > now:
+                    break
+                self.lost += seq_diff(oldest, self.next_seq)
+                self.next_seq = oldest
+                continue
+            if frame[0].timestamp + self.offset > now:
+                break
+            due.append(self.frames.pop(self.next_seq))
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+            self.playing = True
+
+        if not self.frames and not due and self.next_seq is not None \
+                and now - (self.last_header.timestamp + self.offset) > self.target_ms:
+            # Talk spurt over; the next frame starts a new one with a fresh offset.
+            self.next_seq = None
+        elif self.depth_ms(now) > self.target_ms + 2 * self.frame_ms and self.next_seq in self.frames:
+            # Holding more than needed: catch up by skipping one frame.
+            del self.frames[self.next_seq]
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+            self.offset -= self.frame_ms
+        return due
+
+    def stats(self):
+        expected = self.received + self.lost
+        return {'depth_ms': int(self.depth_ms()), 'target_ms': int(self.target_ms), 'jitter_ms': round(self.jitter, 1),
+                'late': self.late, 'lost': self.lost, 'loss': self.lost / expected if expected else 0.0}
@@ -0,0 +1,214 @@
+from collections import deque
+
+import numpy as np
+import pyaudio
+
+PLAYBACK_RATE = 44100
+# How long a silence descriptor's comfort noise plays before fading to silence.
+COMFORT_NOISE_SECONDS = 5
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer ring of int16 samples.
+
+    The producer only ever advances write_index and the consumer only
+    read_index, so the network coroutine and the PortAudio callback thread
+    can share it without a lock.
+    """
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.write_index = 0
+        self.read_index = 0
+        self.overflows = 0
+
+    def available(self):
+        return self.write_index - self.read_index
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        """Copy samples in; whatever does not fit is dropped and counted."""
+        count = min(len(samples), self.free())
+        if count < len(samples):
+            self.overflows += 1
+        start = self.write_index % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        self.buffer[:count - first] = samples[first:count]
+        self.write_index += count
+        return count
+
+    def read_into(self, out):
+        """Fill out from the ring, padding with silence. Returns samples read."""
+        count = min(len(out), self.available())
+        start = self.read_index % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:count] = self.buffer[:count - first]
+        out[count:] = 0
+        self.read_index += count
+        return count
+
+class PlaybackStream:
+    """Output device driven by a PortAudio callback that reads a RingBuffer.
+
+    Writers only copy into the ring, so nothing on the GUI/network loop ever
+    waits for the sound card.
+    """
+
+    def __init__(self, pyaudio_instance, rate=PLAYBACK_RATE, frames_per_buffer=512, buffer_ms=500, device_index=None):
+        self.rate = rate
+        self.ring = RingBuffer(rate * buffer_ms // 1000)
+        self.out = np.zeros(frames_per_buffer, dtype=np.int16)
+        self.underruns = 0
+        self.stream = pyaudio_instance.open(format=pyaudio.paInt16,
+                                            channels=1,
+                                            rate=rate,
+                                            output=True,
+                                            output_device_index=device_index,
+                                            frames_per_buffer=frames_per_buffer,
+                                            stream_callback=self._callback)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        out = self.out if frame_count == len(self.out) else np.zeros(frame_count, dtype=np.int16)
+        read = self.ring.read_into(out)
+        if 0 < read < frame_count:
+            self.underruns += 1
+        return out.tobytes(), pyaudio.paContinue
+
+    def write(self, samples):
+        return self.ring.write(samples)
+
+    def buffered_ms(self):
+        return self.ring.available() * 1000 // self.rate
+
+    def stats(self):
+        return {'buffered_ms': self.buffered_ms(), 'underruns': self.underruns, 'overflows': self.ring.overflows}
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+
+class VoiceMixer:
+    """Sums every speaker's pending audio into one output buffer per tick.
+
+    Per-speaker and master gains are Q8 fixed point, so the whole pass is
+    int32 accumulation with a single clip at the end. Locally muted speakers
+    are drained without being mixed in. Speakers that stopped transmitting
+    (DTX) are replaced by comfort noise at the level their last silence
+    descriptor reported, for the latest such speaker and for a bounded time
+    (COMFORT_NOISE_SECONDS) or until their next frame arrives. Notification
+    sounds are added after the master gain with their own gain, so they
+    stay audible when voice is deafened or turned down.
+    """
+
+    UNITY = 256
+
+    def __init__(self):
+        self.pending = {}  # speaker slot -> deque of int16 arrays
+        self.gains = {}    # speaker slot -> Q8 gain
+        self.muted = set()
+        self.deafened = False
+        self.master_gain = self.UNITY
+        self.effects = []  # [samples, position, Q8 gain] of playing notification sounds
+        self.accumulator = np.zeros(0, dtype=np.int32)
+        self.comfort_noise = {}  # speaker slot -> [noise RMS, samples left]; only the latest speaker
+        self.noise = np.random.default_rng().standard_normal(PLAYBACK_RATE).astype(np.float32)
+        self.noise_position = 0
+
+    @staticmethod
+    def gain_from_db(volume_db):
+        return int(round(VoiceMixer.UNITY * 10 ** (volume_db / 20)))
+
+    def add(self, slot, samples):
+        self.comfort_noise.pop(slot, None)
+        self.pending.setdefault(slot, deque()).append(samples)
+
+    def set_comfort_noise(self, slot, level, duration):
+        """Play comfort noise for slot at level -dBov (from a silence descriptor) for duration samples.
+
+        Only the speaker who stopped last gets noise, so silent speakers do
+        not add up, and it ends after duration so playout can go idle.
+        """
+        self.comfort_noise = {slot: [32768 * 10 ** (-level / 20), duration]}
+
+    def play_effect(self, samples, gain):
+        self.effects.append([samples, 0, gain])
+
+    def active(self):
+        return bool(self.pending or self.comfort_noise or self.effects)
+
+    def clear(self):
+        self.pending.clear()
+        self.comfort_noise.clear()
+
+    def forget(self, slots):
+        """Drop state for speakers that are no longer in the room."""
+        for slot in list(self.comfort_noise):
+            if slot not in slots:
+                del self.comfort_noise[slot]
+
+    def _noise(self, count):
+        indices = (self.noise_position + np.arange(count)) % len(self.noise)
+        self.noise_position = (self.noise_position + count) % len(self.noise)
+        return self.noise[indices]
+
+    def pending_samples(self):
+        voice = max((sum(len(chunk) for chunk in queue) for queue in self.pending.values()), default=0)
+        return max([voice] + [len(samples) - position for samples, position, _ in self.effects])
+
+    def _take(self, queue, count):
+        chunks = []
+        while queue and count > 0:
+            chunk = queue[0]
+            if len(chunk) <= count:
+                chunks.append(queue.popleft())
+            else:
+                chunks.append(chunk[:count])
+                queue[0] = chunk[count:]
+            count -= len(chunks[-1])
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+
+    def mix(self, count):
+        if len(self.accumulator) < count:
+            self.accumulator = np.zeros(count, dtype=np.int32)
+        mixed = self.accumulator[:count]
+        mixed[:] = 0
+
+        for slot, queue in list(self.pending.items()):
+            chunk = self._take(queue, count)
+            if not queue:
+                del self.pending[slot]
+            if self.deafened or slot in self.muted or len(chunk) == 0:
+                continue
+            gain = self.gains.get(slot, self.UNITY)
+            if gain == self.UNITY:
+                mixed[:len(chunk)] += chunk
+            else:
+                mixed[:len(chunk)] += (chunk.astype(np.int32) * gain) >> 8
+
+        for slot, noise in list(self.comfort_noise.items()):
+            rms, remaining = noise
+            noise[1] -= count
+            if noise[1] <= 0:
+                del self.comfort_noise[slot]
+            if self.deafened or slot in self.pending or slot in self.muted:
+                continue
+            length = min(count, remaining)
+            mixed[:length] += (self._noise(length) * (rms * self.gains.get(slot, self.UNITY) / self.UNITY)).astype(np.int32)
+
+        if self.master_gain != self.UNITY:
+            mixed *= self.master_gain
+            mixed >>= 8
+
+        for effect in self.effects:
+            samples, position, gain = effect
+            chunk = samples[position:position + count]
+            mixed[:len(chunk)] += (chunk.astype(np.int32) * gain) >> 8
+            effect[1] += len(chunk)
+        self.effects = [effect for effect in self.effects if effect[1] < len(effect[0])]
+        return np.clip(mixed, -32768, 32767).astype(np.int16)
@@ -0,0 +1,47 @@
+import numpy as np
+
+class Resampler:
+    """Streaming windowed-sinc resampler for int16 mono audio.
+
+    Keeps the tail of the previous block and the fractional read position
+    between calls, so blocks of any size can be fed in without clicks at
+    the block boundaries. Downsampling lowers the cutoff to the new Nyquist
+    frequency to avoid aliasing.
+    """
+
+    def __init__(self, from_rate, to_rate, half_taps=16):
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self.step = from_rate / to_rate
+        self.cutoff = min(1.0, to_rate / from_rate)
+        self.half_taps = half_taps
+        self.offsets = np.arange(-half_taps + 1, half_taps + 1)
+        self.history = np.zeros(2 * half_taps)
+        self.position = float(half_taps)
+
+    @property
+    def passthrough(self):
+        return self.from_rate == self.to_rate
+
+    def process(self, samples):
+        if self.passthrough:
+            return samples
+
+        buffer = np.concatenate((self.history, samples.astype(np.float64)))
+        end = len(buffer) - self.half_taps
+        count = int(np.ceil((end - self.position) / self.step))
+        if count <= 0:
+            self.history = buffer[-2 * self.half_taps:]
+            self.position -= len(buffer) - 2 * self.half_taps
+            return np.zeros(0, dtype=np.int16)
+
+        times = self.position + self.step * np.arange(count)
+        indices = np.floor(times).astype(np.int64)[:, None] + self.offsets
+        distance = times[:, None] - indices
+        window = 0.5 * (1 + np.cos(np.pi * distance / self.half_taps))
+        kernel = self.cutoff * np.sinc(self.cutoff * distance) * window
+        output = (buffer[indices] * kernel).sum(axis=1)
+
+        self.position = times[-1] + self.step - (len(buffer) - 2 * self.half_taps)
+        self.history = buffer[-2 * self.half_taps:]
+        return np.clip(np.round(output), -32768, 32767).astype(np.int16)
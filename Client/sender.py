@@ -0,0 +1,69 @@
+import asyncio
+import time
+from collections import deque
+
+import websockets
+
+class SendQueue:
+    """Hands outgoing messages from the capture thread to one sender coroutine.
+
+    put() may be called from any thread. It appends to a deque and only
+    wakes the event loop when the sender is idle, so while the sender is
+    busy whole batches pile up without further cross-thread wakeups.
+    Messages are sent in the order they were put.
+    """
+
+    def __init__(self, websocket, loop):
+        self.websocket = websocket
+        self.loop = loop
+        self.queue = deque()  # (enqueued at, message)
+        self.wakeup = asyncio.Event()
+        self.idle = True
+        self.closed = False
+        self.sent = 0
+        self.batches = 0
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def put(self, message):
+        if self.closed:
+            return
+        self.queue.append((time.monotonic(), message))
+        if self.idle:
+            self.idle = False
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        try:
+            while not self.closed:
+                self.idle = True
+                # Re-check after flagging idle: a put() in between did not wake us.
+                if not self.queue:
+                    await self.wakeup.wait()
+                    self.wakeup.clear()
+                self.idle = False
+
+                batch = []
+                while self.queue:
+                    batch.append(self.queue.popleft())
+                if batch:
+                    self.batches += 1
+                for enqueued, message in batch:
+                    latency_ms = (time.monotonic() - enqueued) * 1000
+                    self.latency_ms += (latency_ms - self.latency_ms) / 16
+                    self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+                    await self.websocket.send(message)
+                    self.sent += 1
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self.queue.clear()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+    def stats(self):
+        return {'queued': len(self.queue), 'sent': self.sent, 'batches': self.batches,
+                'latency_ms': round(self.latency_ms, 1), 'max_latency_ms': round(self.max_latency_ms, 1)}
@@ -0,0 +1,58 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# Sound bank layout, written by Utils/build_sound_bank.py (keep them in sync):
+#   magic    4 bytes  b'PSBK'
+#   version  uint16   BANK_VERSION
+#   rate     uint32   sample rate of every sound
+#   count    uint16   number of index entries
+# then count index entries:
+#   name_len uint8, name (utf-8), offset uint32 (bytes from file start), samples uint32
+# followed by the mono int16 little-endian PCM of every sound.
+BANK_MAGIC = b'PSBK'
+BANK_VERSION = 1
+BANK_HEADER = struct.Struct('<4sHIH')
+BANK_ENTRY = struct.Struct('<II')
+
+def sound_name(path):
+    """Key a sound file is stored under: its lower-case file name without extension."""
+    return os.path.splitext(os.path.basename(path))[0].lower()
+
+class SoundBank:
+    """Memory-mapped sound bank; get() returns zero-copy int16 views into the file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.rate, count = BANK_HEADER.unpack_from(self.mmap)
+        if magic != BANK_MAGIC or version != BANK_VERSION:
+            self.mmap.close()
+            raise ValueError(f"{path} is not a version {BANK_VERSION} sound bank")
+
+        self.sounds = {}
+        position = BANK_HEADER.size
+        for _ in range(count):
+            name_len = self.mmap[position]
+            name = self.mmap[position + 1:position + 1 + name_len].decode('utf-8')
+            position += 1 + name_len
+            offset, samples = BANK_ENTRY.unpack_from(self.mmap, position)
+            position += BANK_ENTRY.size
+            self.sounds[name] = np.frombuffer(self.mmap, dtype='<i2', count=samples, offset=offset)
+
+    def __contains__(self, name):
+        return name in self.sounds
+
+    def get(self, name):
+        return self.sounds.get(name)
+
+    def close(self):
+        self.sounds = {}
+        try:
+            self.mmap.close()
+        except BufferError:
+            # Sounds still playing hold views; the mapping goes away with them.
+            pass
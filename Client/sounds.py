@@ -0,0 +1,140 @@
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtMultimedia import QAudioDecoder, QAudioFormat
+
+from resample import Resampler
+from soundbank import SoundBank, sound_name
+
+NOTIFICATION_SOUNDS = [
+    'assets/sound/connected.mp3',
+    'assets/sound/disconnected.mp3',
+    'assets/sound/connection_lost.mp3',
+    'assets/sound/channel_switched.mp3',
+    'assets/sound/mic_muted.mp3',
+    'assets/sound/mic_activated.mp3',
+    'assets/sound/sound_muted.mp3',
+    'assets/sound/sound_resumed.mp3',
+]
+
+class SoundCache:
+    """Notification sounds decoded once to mono int16 PCM at the output rate.
+
+    QAudioDecoder works asynchronously, so load() hands the samples to its
+    callback once decoding has finished, or right away when the sound is
+    already cached. The max_sounds most recently used sounds are kept.
+    With a sound bank loaded, sounds it contains are served straight from
+    the memory map (resampled once if the bank's rate differs).
+    """
+
+    def __init__(self, rate, max_sounds=16):
+        self.rate = rate
+        self.max_sounds = max_sounds
+        self.sounds = OrderedDict()  # path -> int16 samples
+        self.decoding = {}  # path -> (QAudioDecoder, chunks, callbacks)
+        self.bank = None
+
+    def load_bank(self, path):
+        """Serve sounds from the bank at path, or from the sound files if path is empty."""
+        if self.bank is not None:
+            self.bank.close()
+            self.bank = None
+        self.sounds.clear()
+        if path:
+            try:
+                self.bank = SoundBank(path)
+            except (OSError, ValueError) as e:
+                print(f"Failed to load sound bank {path}: {e}")
+
+    def set_rate(self, rate):
+        """Switch output rate; cached sounds are decoded again at the new rate."""
+        if rate == self.rate:
+            return
+        self.rate = rate
+        paths = list(self.sounds)
+        self.sounds.clear()
+        self.preload(paths)
+
+    def preload(self, paths):
+        for path in paths:
+            self.load(path)
+
+    def load(self, path, callback=None):
+        samples = self.sounds.get(path)
+        if samples is not None:
+            self.sounds.move_to_end(path)
+            if callback is not None:
+                callback(samples)
+            return
+        if self.bank is not None and sound_name(path) in self.bank:
+            samples = self.bank.get(sound_name(path))
+            if self.bank.rate != self.rate:
+                samples = self._store(path, Resampler(self.bank.rate, self.rate).process(samples))
+            if callback is not None:
+                callback(samples)
+            return
+        if path in self.decoding:
+            if callback is not None:
+                self.decoding[path][2].append(callback)
+            return
+
+        audio_format = QAudioFormat()
+        audio_format.setCodec('audio/pcm')
+        audio_format.setSampleRate(self.rate)
+        audio_format.setChannelCount(1)
+        audio_format.setSampleSize(16)
+        audio_format.setSampleType(QAudioFormat.SignedInt)
+        audio_format.setByteOrder(QAudioFormat.LittleEndian)
+
+        decoder = QAudioDecoder()
+        decoder.setAudioFormat(audio_format)
+        decoder.setSourceFilename(path)
+        decoder.bufferReady.connect(lambda: self._read(path))
+        decoder.finished.connect(lambda: self._finish(path))
+        decoder.error.connect(lambda error: self._fail(path))
+        self.decoding[path] = (decoder, [], [callback] if callback is not None else [])
+        decoder.start()
+
+    def _read(self, path):
+        decoder, chunks, _ = self.decoding[path]
+        buffer = decoder.read()
+        buffer_format = buffer.format()
+        data = buffer.constData().asstring(buffer.byteCount())
+        # Backends may ignore the requested format; convert what they give us.
+        if buffer_format.sampleType() == QAudioFormat.Float:
+            samples = (np.frombuffer(data, dtype=np.float32) * 32767).astype(np.int16)
+        else:
+            samples = np.frombuffer(data, dtype=np.int16)
+        channels = buffer_format.channelCount()
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        chunks.append((buffer_format.sampleRate(), samples))
+
+    def _finish(self, path):
+        if path not in self.decoding:
+            return
+        decoder, chunks, callbacks = self.decoding.pop(path)
+        decoder.deleteLater()
+        if not chunks:
+            return
+        samples = np.concatenate([chunk for _, chunk in chunks])
+        source_rate = chunks[0][0]
+        if source_rate != self.rate:
+            samples = Resampler(source_rate, self.rate).process(samples)
+
+        self._store(path, samples)
+        for callback in callbacks:
+            callback(samples)
+
+    def _store(self, path, samples):
+        self.sounds[path] = samples
+        while len(self.sounds) > self.max_sounds:
+            self.sounds.popitem(last=False)
+        return samples
+
+    def _fail(self, path):
+        if path not in self.decoding:
+            return
+        decoder, _, _ = self.decoding.pop(path)
+        print(f"Failed to decode {path}: {decoder.errorString()}")
+        decoder.deleteLater()
@@ -0,0 +1,82 @@
+from frames import CODEC_PCM16, FrameHeader
+from jitter import JitterBuffer
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def header(sequence, timestamp):
+    return FrameHeader(1, CODEC_PCM16, sequence, timestamp, 1, 0)
+
+def play(jitter_buffer, clock, until, step=5):
+    played = []
+    while clock.now < until:
+        clock.now += step
+        played.extend(frame_header.sequence for frame_header, _ in jitter_buffer.pop())
+    return played
+
+def test_pre_roll_burst_is_played_in_full():
+    clock = FakeClock()
+    jitter_buffer = JitterBuffer(target_ms=60, clock=clock)
+    network_ms = 10
+
+    # Push-to-talk pressed at 200 ms: ten buffered pre-roll frames arrive at once...
+    clock.now = 200 + network_ms
+    for sequence in range(10):
+        jitter_buffer.push(header(sequence, sequence * 20), b'')
+    played = play(jitter_buffer, clock, 200)
+
+    # ...followed by live frames arriving on time.
+    for sequence in range(10, 30):
+        clock.now = max(clock.now, sequence * 20 + network_ms)
+        jitter_buffer.push(header(sequence, sequence * 20), b'')
+        played.extend(play(jitter_buffer, clock, clock.now + 20))
+    played.extend(play(jitter_buffer, clock, clock.now + 200))
+
+    assert played == list(range(30))
+    assert jitter_buffer.lost == 0
+
+def test_steady_stream_plays_every_frame_after_target_delay():
+    clock = FakeClock()
+    jitter_buffer = JitterBuffer(target_ms=60, clock=clock)
+    played = []
+    first_played_at = None
+    for sequence in range(50):
+        clock.now = sequence * 20 + 10
+        jitter_buffer.push(header(sequence, sequence * 20), b'')
+        for step in range(4):
+            clock.now += 5
+            due = jitter_buffer.pop()
+            if due and first_played_at is None:
+                first_played_at = clock.now
+            played.extend(frame_header.sequence for frame_header, _ in due)
+    played.extend(play(jitter_buffer, clock, clock.now + 200))
+
+    assert played == list(range(50))
+    assert first_played_at - 10 >= 60
+
+def test_slot_reused_by_new_sender_plays_every_frame():
+    clock = FakeClock()
+    jitter_buffer = JitterBuffer(target_ms=60, clock=clock)
+
+    # The previous owner of the slot talked with high sequence numbers...
+    for sequence in range(5000, 5050):
+        clock.now = (sequence - 5000) * 20 + 10
+        jitter_buffer.push(header(sequence, sequence * 20), b'')
+        play(jitter_buffer, clock, clock.now + 20)
+    play(jitter_buffer, clock, clock.now + 500)
+
+    # ...then a new sender gets the slot, starting from sequence 0 on its own clock.
+    start = clock.now
+    played = []
+    for sequence in range(100):
+        clock.now = max(clock.now, start + sequence * 20 + 10)
+        jitter_buffer.push(header(sequence, 70000 + sequence * 20), b'')
+        played.extend(play(jitter_buffer, clock, clock.now + 20))
+    played.extend(play(jitter_buffer, clock, clock.now + 500))
+
+    assert played == list(range(100))
+    assert jitter_buffer.next_seq is None
@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+
+class VoiceActivityDetector:
+    """Frame-level voice activity detector with attack and hangover.
+
+    A frame counts as voiced when its RMS level in dBFS reaches threshold_db
+    and, if band_ratio is set, at least that share of its energy falls in
+    the 300-3400 Hz speech band. Talking starts after attack_ms of voiced
+    frames and ends once hangover_ms have passed without one; both are
+    plain counters, so each frame costs O(1) beyond the level computation.
+    """
+
+    SPEECH_BAND = (300, 3400)
+
+    def __init__(self, sample_rate, frame_samples, threshold_db=-40.0, attack_ms=40, hangover_ms=300, band_ratio=0.0):
+        frame_ms = 1000 * frame_samples / sample_rate
+        self.sample_rate = sample_rate
+        self.threshold_db = threshold_db
+        self.attack_frames = max(1, math.ceil(attack_ms / frame_ms))
+        self.hangover_frames = max(1, math.ceil(hangover_ms / frame_ms))
+        self.band_ratio = band_ratio
+        self.voiced_run = 0
+        self.hangover = 0
+        self.talking = False
+        self.level_db = -math.inf
+
+    @staticmethod
+    def threshold_from_setting(vad_level):
+        """Map the -50..50 'vad_level' slider to a -90..-10 dBFS threshold."""
+        return -50.0 + 0.8 * vad_level
+
+    def level(self, samples):
+        rms = math.sqrt(float(np.mean(np.square(samples, dtype=np.float32)))) if len(samples) else 0.0
+        return 20 * math.log10(rms / 32768) if rms > 0 else -math.inf
+
+    def speech_band_ratio(self, samples):
+        power = np.abs(np.fft.rfft(samples.astype(np.float32))) ** 2
+        frequencies = np.fft.rfftfreq(len(samples), 1 / self.sample_rate)
+        total = power.sum()
+        if total == 0:
+            return 0.0
+        low, high = self.SPEECH_BAND
+        return float(power[(frequencies >= low) & (frequencies <= high)].sum() / total)
+
+    def is_voiced(self, samples):
+        self.level_db = self.level(samples)
+        if self.level_db < self.threshold_db:
+            return False
+        return not self.band_ratio or self.speech_band_ratio(samples) >= self.band_ratio
+
+    def process(self, samples):
+        """Feed one frame and return whether the user is talking."""
+        if self.is_voiced(samples):
+            self.voiced_run += 1
+            self.hangover = self.hangover_frames
+            if not self.talking and self.voiced_run >= self.attack_frames:
+                self.talking = True
+        else:
+            self.voiced_run = 0
+            if self.talking:
+                self.hangover -= 1
+                if self.hangover <= 0:
+                    self.talking = False
+        return self.talking
@@ -0,0 +1,59 @@
+import numpy as np
+
+from frames import CODEC_PCM16, CODEC_ULAW
+
+# Mirrors Server/voice_codec.py, which uses the same codecs to mix rooms.
+
+class Pcm16Codec:
+    """Uncompressed 16-bit mono PCM."""
+    codec_id = CODEC_PCM16
+    name = 'pcm16'
+
+    def encode(self, samples):
+        return samples.astype(np.int16, copy=False).tobytes()
+
+    def decode(self, payload):
+        return np.frombuffer(payload, dtype=np.int16)
+
+class MuLawCodec:
+    """ITU-T G.711 mu-law: 8 bits per sample, half the size of PCM16."""
+    codec_id = CODEC_ULAW
+    name = 'ulaw'
+
+    BIAS = 0x84
+    CLIP = 32635
+
+    def __init__(self):
+        codes = ~np.arange(256, dtype=np.int32) & 0xFF
+        exponent = (codes >> 4) & 0x07
+        magnitude = (((codes & 0x0F) << 3) + self.BIAS << exponent) - self.BIAS
+        self.decode_table = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+    def encode(self, samples):
+        samples = samples.astype(np.int32)
+        sign = np.where(samples < 0, 0x80, 0)
+        magnitude = np.minimum(np.abs(samples), self.CLIP) + self.BIAS
+        exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 7, 0, 7)
+        mantissa = (magnitude >> (exponent + 3)) & 0x0F
+        return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+    def decode(self, payload):
+        return self.decode_table[np.frombuffer(payload, dtype=np.uint8)]
+
+CODECS = {codec.name: codec for codec in (MuLawCodec(), Pcm16Codec())}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+def get_codec(name):
+    return CODECS[name]
+
+def codec_by_id(codec_id):
+    return CODECS_BY_ID.get(codec_id)
+
+def negotiate_codec(offered, preferred):
+    """Pick the first codec in the server's preference list that the client offered."""
+    for name in preferred:
+        if name in offered and name in CODECS:
+            return CODECS[name]
+    return CODECS['pcm16']
+
+SUPPORTED_CODECS = list(CODECS)
@@ -2,10 +2,10 @@ import asyncio
 import logging
 from datetime import datetime
 
-async def backup_database(db_file, backup_folder, backup_interval_minutes):
+async def backup_database(db, backup_folder, backup_interval_minutes):
     while True:
         await asyncio.sleep(backup_interval_minutes * 60)
         backup_file = f"{backup_folder}/backup_{datetime.now().strftime('%Y%m%d%H%M%S')}.db"
-        with open(db_file, 'rb') as src, open(backup_file, 'wb') as dst:
-            dst.write(src.read())
+        # A plain file copy would miss commits that are still in the WAL.
+        await db.backup(backup_file)
         logging.info(f"Database backed up to {backup_file}")
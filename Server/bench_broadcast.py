@@ -0,0 +1,40 @@
+"""Per-event cost of broadcasting control messages to a room.
+
+Compares encoding the payload once per recipient (the old pattern) with
+broadcast_json(), which encodes once and fans the same string out.
+Run from the Server directory: python bench_broadcast.py
+"""
+import json
+import timeit
+import uuid
+
+from broadcast import Outbox, broadcast, broadcast_json
+
+class IdleWebSocket:
+    open = True
+
+def per_recipient(outboxes, payload):
+    for outbox in outboxes:
+        broadcast([outbox], json.dumps(payload))
+
+def payloads(members):
+    member_details = [{'username': f'user{i}', 'id': str(uuid.uuid4()), 'slot': i + 1} for i in range(members)]
+    return {
+        'room_update': {'type': 'room_update', 'members': member_details},
+        'talking': {'type': 'talking', 'username': 'user0', 'status': True},
+        'message': {'type': 'message', 'username': 'user0', 'message': 'hello ' * 20},
+    }
+
+def main(repeat=5, number=200):
+    print(f"{'members':>8} {'payload':<12} {'per recipient':>14} {'encode once':>12} {'speedup':>8}")
+    for members in (10, 50, 200):
+        outboxes = [Outbox(IdleWebSocket()) for _ in range(members)]
+        for name, payload in payloads(members).items():
+            before = min(timeit.repeat(lambda: per_recipient(outboxes, payload), repeat=repeat, number=number)) / number
+            after = min(timeit.repeat(lambda: broadcast_json(outboxes, payload), repeat=repeat, number=number)) / number
+            for outbox in outboxes:
+                outbox.control.clear()
+            print(f"{members:>8} {name:<12} {before * 1e6:>11.1f} us {after * 1e6:>9.1f} us {before / after:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
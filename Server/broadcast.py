@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict, deque
+
+import websockets
+
+class Outbox:
+    """Outbound queue for one connection, drained by its own writer task.
+
+    Audio frames go into a bounded queue that drops the oldest frame when it
+    is full, so a listener on a congested link only loses stale audio.
+    Control messages are never dropped and are written before queued audio.
+    """
+
+    def __init__(self, websocket, max_audio_frames=32):
+        self.websocket = websocket
+        self.audio = deque(maxlen=max_audio_frames)
+        self.control = deque()
+        self.audio_dropped = 0
+        self.sent = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+
+    @property
+    def depth(self):
+        return len(self.audio) + len(self.control)
+
+    def put_audio(self, frame):
+        """Queue an audio frame. Returns False if an older frame was dropped for it."""
+        dropped = len(self.audio) == self.audio.maxlen
+        if dropped:
+            self.audio_dropped += 1
+        self.audio.append(frame)
+        self._wakeup.set()
+        return not dropped
+
+    def put_control(self, message):
+        self.control.append(message)
+        self._wakeup.set()
+
+    def stats(self):
+        return {'depth': self.depth, 'audio_depth': len(self.audio),
+                'audio_dropped': self.audio_dropped, 'sent': self.sent}
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while not self.closed and (self.control or self.audio):
+                    message = self.control.popleft() if self.control else self.audio.popleft()
+                    await self.websocket.send(message)
+                    self.sent += 1
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+
+class FanoutStats:
+    """Per-room counters for broadcast fan-out."""
+
+    def __init__(self):
+        self.rooms = defaultdict(lambda: {'broadcasts': 0, 'sent': 0, 'dropped': 0, 'skipped': 0})
+
+    def record(self, room_name, sent, dropped, skipped):
+        counters = self.rooms[room_name]
+        counters['broadcasts'] += 1
+        counters['sent'] += sent
+        counters['dropped'] += dropped
+        counters['skipped'] += skipped
+
+    def snapshot(self, reset=False):
+        rooms = {room_name: dict(counters) for room_name, counters in self.rooms.items()}
+        if reset:
+            self.rooms.clear()
+        return rooms
+
+fanout_stats = FanoutStats()
+
+def broadcast(outboxes, message, room_name=None, audio=False):
+    """Queue one message on many connections without awaiting any of them.
+
+    Each connection's writer task does the actual send, so a slow client
+    never delays the ones after it. Audio may displace the oldest queued
+    frame (counted as dropped); closed connections are skipped.
+    Returns a (sent, dropped, skipped) tuple.
+    """
+    sent = dropped = skipped = 0
+    for outbox in outboxes:
+        if outbox.closed or not outbox.websocket.open:
+            skipped += 1
+            continue
+        if audio:
+            if not outbox.put_audio(message):
+                dropped += 1
+        else:
+            outbox.put_control(message)
+        sent += 1
+
+    fanout_stats.record(room_name, sent, dropped, skipped)
+    return sent, dropped, skipped
+
+def encode_json(payload):
+    """Compact JSON text for a control message."""
+    return json.dumps(payload, separators=(',', ':'))
+
+def broadcast_json(outboxes, payload, room_name=None):
+    """Encode payload once and queue the same string on every outbox."""
+    return broadcast(outboxes, encode_json(payload), room_name)
+
+async def log_fanout_stats(interval_seconds, clients):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        for room_name, counters in fanout_stats.snapshot(reset=True).items():
+            logging.info(f"Fan-out {room_name or '*'}: {counters['broadcasts']} broadcasts, "
+                         f"{counters['sent']} sent, {counters['dropped']} dropped, {counters['skipped']} skipped")
+        for client_id, client in list(clients.items()):
+            stats = client['outbox'].stats()
+            if stats['depth'] or stats['audio_dropped']:
+                logging.info(f"Outbox {client['username'] or client_id}: depth {stats['depth']}, "
+                             f"{stats['audio_dropped']} audio frames dropped")
@@ -1,8 +1,72 @@
+import asyncio
 import sqlite3
-import json
 import secrets
 import hashlib
 import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Schema upgrades, applied in order on top of init_db's tables. PRAGMA
+# user_version records the last one applied.
+MIGRATIONS = {
+    1: [
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages (room_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_bans_user_id ON bans (user_id)",
+    ],
+    2: [
+        '''CREATE TABLE IF NOT EXISTS room_members (
+            room_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (room_id, user_id),
+            FOREIGN KEY (room_id) REFERENCES rooms (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+    ],
+    3: [
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages (room_id, id)",
+    ],
+}
+SCHEMA_VERSION = max(MIGRATIONS)
+
+# One page of a room's chat, newest first, continuing below a message id.
+# Keyset pagination on (room_id, id) costs O(limit) however deep the page is.
+HISTORY_QUERY = '''
+    SELECT messages.id, users.username, messages.message, messages.timestamp
+    FROM messages LEFT JOIN users ON users.id = messages.user_id
+    WHERE messages.room_id=? AND messages.id<?
+    ORDER BY messages.id DESC LIMIT ?
+'''
+
+# Queries the server runs while clients are connected. None of them may
+# need a full table scan. tests/test_database.py checks that every query in
+# server.py is listed here or in STARTUP_QUERIES.
+HOT_QUERIES = [
+    "SELECT * FROM users WHERE uid=?",
+    "INSERT OR IGNORE INTO users (uid, username, password, role, is_superadmin) VALUES (?, ?, ?, ?, ?)",
+    "SELECT id FROM users WHERE username=?",
+    "SELECT uid FROM users WHERE username=?",
+    "SELECT role FROM users WHERE uid=?",
+    "UPDATE users SET role=? WHERE uid=?",
+    "SELECT * FROM rooms WHERE name=?",
+    "SELECT id FROM rooms WHERE name=?",
+    "INSERT OR IGNORE INTO rooms (name) VALUES (?)",
+    "INSERT OR IGNORE INTO rooms (name, password) VALUES (?, ?)",
+    "UPDATE rooms SET password=? WHERE name=?",
+    "DELETE FROM rooms WHERE name=?",
+    "INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)",
+    "DELETE FROM room_members WHERE room_id=? AND user_id=?",
+    "DELETE FROM room_members WHERE room_id=?",
+    "SELECT role FROM privilege_keys WHERE key=?",
+    "INSERT INTO bans (user_id, reason) VALUES (?, ?)",
+    HISTORY_QUERY,
+]
+
+# Queries run once at startup that read a whole table on purpose.
+STARTUP_QUERIES = [
+    "SELECT id, name, password FROM rooms ORDER BY id",
+]
 
 def init_db(db_file):
     conn = sqlite3.connect(db_file)
@@ -23,8 +87,7 @@ def init_db(db_file):
     CREATE TABLE IF NOT EXISTS rooms (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT UNIQUE NOT NULL,
-        password TEXT,
-        members TEXT
+        password TEXT
     )
     ''')
 
@@ -70,7 +133,7 @@ def ensure_default_rooms(db_file):
     room = cursor.fetchone()
 
     if not room:
-        cursor.execute("INSERT INTO rooms (name, members) VALUES (?, ?)", ('Lobby', json.dumps([])))
+        cursor.execute("INSERT INTO rooms (name) VALUES (?)", ('Lobby',))
         conn.commit()
 
     conn.close()
@@ -111,5 +174,252 @@ def create_initial_privilege_key(db_file):
 
     conn.close()
 
+def upgrade_schema(db_file):
+    conn = sqlite3.connect(db_file)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        logging.warning(f"Database schema version {version} is newer than this server's ({SCHEMA_VERSION})")
+    for target in sorted(MIGRATIONS):
+        if target <= version:
+            continue
+        with conn:
+            for statement in MIGRATIONS[target]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+        logging.info(f"Database schema upgraded to version {target}")
+    conn.close()
+
+def reconcile_room_members(db_file):
+    """Clear membership left over from the last run; nobody is connected at startup."""
+    conn = sqlite3.connect(db_file)
+    with conn:
+        stale = conn.execute("DELETE FROM room_members").rowcount
+        # Databases created before room_members still carry the old JSON column.
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(rooms)")]
+        if 'members' in columns:
+            stale += conn.execute("UPDATE rooms SET members=NULL WHERE members IS NOT NULL").rowcount
+    conn.close()
+    if stale:
+        logging.info(f"Cleared {stale} stale room membership entries")
+
+def audit_query_plans(db_file):
+    """Return (query, plan step) for every hot query that scans a whole table."""
+    conn = sqlite3.connect(db_file)
+    scans = []
+    for query in HOT_QUERIES:
+        params = (None,) * query.count('?')
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params):
+            detail = row[-1]
+            if detail.startswith('SCAN'):
+                scans.append((query, detail))
+    conn.close()
+    return scans
+
 def get_db_connection(db_file):
     return sqlite3.connect(db_file)
+
+class Database:
+    """Long-lived SQLite connection owned by a single worker thread.
+
+    Every query runs on that thread, so handlers await the result and a
+    slow commit or fsync never stalls the event loop (and with it audio
+    fan-out). One writer thread also serialises all writes, which is what
+    SQLite wants anyway. The connection runs in WAL mode so reads never wait
+    for a writer and commits need fewer fsyncs.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-8000",
+    )
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.conn = None
+
+    def _call(self, function, args):
+        if self.conn is None:
+            # Created on the worker thread, the only thread that ever uses it.
+            self.conn = sqlite3.connect(self.db_file)
+            for pragma in self.PRAGMAS:
+                self.conn.execute(pragma)
+        return function(self.conn, *args)
+
+    async def run(self, function, *args):
+        """Run function(conn, *args) on the database thread and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, function, args)
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        """Run one write statement in its own transaction and return the cursor's lastrowid."""
+        def execute(conn):
+            with conn:
+                return conn.execute(sql, params).lastrowid
+        return await self.run(execute)
+
+    async def fetch_or_insert(self, select_sql, select_params, insert_sql, insert_params):
+        """Return the row select_sql finds, inserting it first if it is missing.
+
+        Both steps run back to back on the database thread, so concurrent
+        callers cannot both see the row missing. insert_sql should use
+        INSERT OR IGNORE so a row added by another connection is kept.
+        """
+        def fetch_or_insert(conn):
+            row = conn.execute(select_sql, select_params).fetchone()
+            if row is None:
+                with conn:
+                    conn.execute(insert_sql, insert_params)
+                row = conn.execute(select_sql, select_params).fetchone()
+            return row
+        return await self.run(fetch_or_insert)
+
+    def submit(self, sql, params=()):
+        """Queue one write statement without waiting for it; failures are logged.
+
+        The statement joins the database thread's queue right away, so it
+        still runs in order with everything awaited before and after it.
+        """
+        def execute(conn):
+            with conn:
+                conn.execute(sql, params)
+
+        def report(future):
+            if not future.cancelled() and future.exception() is not None:
+                logging.error(f"Background write failed: {sql.strip()}: {future.exception()}")
+
+        asyncio.get_running_loop().run_in_executor(self.executor, self._call, execute, ()).add_done_callback(report)
+
+    async def executemany(self, sql, rows):
+        """Run one statement for every row in a single transaction."""
+        def executemany(conn):
+            with conn:
+                conn.executemany(sql, rows)
+        await self.run(executemany)
+
+    async def backup(self, backup_file):
+        """Consistent copy of the database, including pages still in the WAL."""
+        def backup(conn):
+            target = sqlite3.connect(backup_file)
+            with target:
+                conn.backup(target)
+            target.close()
+        await self.run(backup)
+
+    def close(self):
+        if self.conn is not None:
+            self.executor.submit(self.conn.close)
+        self.executor.shutdown(wait=True)
+
+class MessageWriter:
+    """Write-behind queue for chat messages.
+
+    add() assigns the message id in memory and returns right away, so chat
+    is broadcast without waiting for the disk. A background task commits
+    whatever is queued in one transaction flush_ms after the first message,
+    or as soon as batch_size messages are waiting. A batch that fails to
+    commit goes back to the front of the queue and is retried; after
+    max_attempts failures it is dropped and handed to on_dropped, since its
+    ids have already been broadcast. close() writes what is left, giving up
+    after timeout seconds.
+    """
+
+    def __init__(self, db, flush_ms=50, batch_size=100, max_attempts=3, on_dropped=None):
+        self.db = db
+        self.interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.on_dropped = on_dropped  # callable(list of dropped rows)
+        self.pending = []  # (id, room_id, user_id, message, timestamp)
+        self.wakeup = asyncio.Event()
+        self.last_id = None
+        self.failures = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    async def start(self):
+        """Continue message ids after the highest one already stored."""
+        self.last_id = (await self.db.fetchone("SELECT COALESCE(MAX(id), 0) FROM messages"))[0]
+
+    def add(self, room_id, user_id, message, timestamp):
+        self.last_id += 1
+        self.pending.append((self.last_id, room_id, user_id, message, timestamp))
+        if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+        return self.last_id
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await self.db.executemany("INSERT INTO messages (id, room_id, user_id, message, timestamp) VALUES (?, ?, ?, ?, ?)", batch)
+        except sqlite3.Error as e:
+            self.failures += 1
+            if self.failures < self.max_attempts:
+                logging.warning(f"Failed to save {len(batch)} chat messages, will retry: {e}")
+                self.pending[:0] = batch
+                self.wakeup.set()
+                return
+            logging.error(f"Dropping {len(batch)} chat messages after {self.failures} failed attempts: {e}")
+            self.failures = 0
+            self.dropped += len(batch)
+            if self.on_dropped is not None:
+                self.on_dropped(batch)
+            return
+        self.failures = 0
+        self.written += len(batch)
+        self.batches += 1
+
+    def stats(self):
+        return {'written': self.written, 'batches': self.batches, 'dropped': self.dropped, 'queued': len(self.pending)}
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.failures:
+                # Back off before retrying a batch that failed to commit.
+                await asyncio.sleep(self.interval * self.failures)
+            elif len(self.pending) < self.batch_size:
+                # Give the batch flush_ms to fill up; add() wakes us early if it does.
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+            await self.flush()
+
+    async def close(self, timeout=5.0):
+        async def drain():
+            # Each failed flush re-queues the batch until max_attempts drops it.
+            while self.pending:
+                await self.flush()
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Chat flush did not finish within {timeout} s on shutdown")
+        stats = self.stats()
+        logging.info(f"Chat writer: {stats['written']} messages saved in {stats['batches']} batches, "
+                     f"{stats['dropped']} dropped, {stats['queued']} unsaved")
+
+if __name__ == '__main__':
+    # python database.py DB/pyspeak.db -- upgrade the schema and fail on full table scans.
+    db_file = sys.argv[1] if len(sys.argv) > 1 else 'DB/pyspeak.db'
+    init_db(db_file)
+    upgrade_schema(db_file)
+    scans = audit_query_plans(db_file)
+    for query, detail in scans:
+        print(f"Full table scan: {query}\n    {detail}")
+    print(f"{len(HOT_QUERIES) - len({query for query, _ in scans})}/{len(HOT_QUERIES)} hot queries use an index")
+    sys.exit(1 if scans else 0)
@@ -0,0 +1,53 @@
+import math
+import struct
+from collections import namedtuple
+
+# Binary audio frame layout, shared with Client/frames.py (keep them in sync):
+#   version  uint8   FRAME_VERSION
+#   codec    uint8   codec id, see CODEC_*
+#   sequence uint16  per-sender frame counter, wraps at 65536
+#   timestamp uint32 sender capture time in milliseconds, wraps
+#   speaker  uint8   speaker slot, assigned by the server (0 = server mix)
+#   level    uint8   audio level in -dBov, 0 (loudest) to 127 (silence)
+# followed by the codec payload.
+FRAME_VERSION = 1
+HEADER = struct.Struct('!BBHIBB')
+HEADER_SIZE = HEADER.size
+SPEAKER_OFFSET = 8
+
+CODEC_PCM16 = 0
+CODEC_ULAW = 1
+# Silence descriptor: empty payload, level carries the sender's background noise.
+CODEC_COMFORT_NOISE = 13
+
+MIX_SPEAKER = 0
+MAX_SPEAKER = 255
+SILENCE_LEVEL = 127
+
+FrameHeader = namedtuple('FrameHeader', 'version codec sequence timestamp speaker level')
+
+def pack_frame(codec, sequence, timestamp, level, payload, speaker=0):
+    return HEADER.pack(FRAME_VERSION, codec, sequence & 0xFFFF, timestamp & 0xFFFFFFFF, speaker, level) + payload
+
+def unpack_frame(frame):
+    """Split a frame into (FrameHeader, payload). Raises ValueError on a malformed frame."""
+    if len(frame) < HEADER_SIZE:
+        raise ValueError(f"Audio frame too short ({len(frame)} bytes)")
+    header = FrameHeader(*HEADER.unpack_from(frame))
+    if header.version != FRAME_VERSION:
+        raise ValueError(f"Unsupported audio frame version {header.version}")
+    return header, memoryview(frame)[HEADER_SIZE:]
+
+def set_speaker(frame, speaker):
+    frame = bytearray(frame)
+    frame[SPEAKER_OFFSET] = speaker
+    return bytes(frame)
+
+def audio_level(samples):
+    """Audio level of int16 samples in -dBov as carried in the header."""
+    if len(samples) == 0:
+        return SILENCE_LEVEL
+    rms = math.sqrt(float((samples.astype('float64') ** 2).mean()))
+    if rms < 1:
+        return SILENCE_LEVEL
+    return min(SILENCE_LEVEL, max(0, int(round(-20 * math.log10(rms / 32768)))))
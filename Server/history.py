@@ -0,0 +1,60 @@
+from collections import deque
+
+class RecentMessages:
+    """The last size chat messages of every room, kept in memory.
+
+    Joiners get their room's recent context from here without touching
+    SQLite. Each buffer holds the newest messages of its room: seeded from
+    the database at startup, then fed by every new message. A room is
+    complete while its buffer holds the room's entire history: seeded from
+    fewer than size rows, or created empty, and never overflowed since.
+    Only then does page() report that nothing older is left.
+    """
+
+    def __init__(self, size=50):
+        self.size = size
+        self.rooms = {}  # room id -> deque of message dicts, oldest first
+        self.complete = set()  # room ids whose buffer holds their whole history
+
+    def seed(self, room_id, messages):
+        """Load a room's newest messages (oldest first) as read from the database."""
+        self.rooms[room_id] = deque(messages, maxlen=self.size)
+        if len(messages) < self.size:
+            self.complete.add(room_id)
+        else:
+            self.complete.discard(room_id)
+
+    def add(self, room_id, message):
+        room = self.rooms.get(room_id)
+        if room is None:
+            # A room created since startup: nothing older is in the database.
+            room = self.rooms[room_id] = deque(maxlen=self.size)
+            self.complete.add(room_id)
+        if len(room) == self.size:
+            self.complete.discard(room_id)
+        room.append(message)
+
+    def discard(self, room_id, message_id):
+        room = self.rooms.get(room_id)
+        if room is not None:
+            self.rooms[room_id] = deque((message for message in room if message['id'] != message_id), maxlen=self.size)
+
+    def remove_room(self, room_id):
+        self.rooms.pop(room_id, None)
+        self.complete.discard(room_id)
+
+    def page(self, room_id, before_id=None, limit=50):
+        """Up to limit messages older than before_id, oldest first, plus whether older ones exist.
+
+        Returns None when the buffer cannot answer and the database has to.
+        Unless the room is complete, older messages may be in the database,
+        so it reports more.
+        """
+        room = self.rooms.get(room_id, ())
+        complete = room_id in self.complete
+        older = [message for message in room if before_id is None or message['id'] < before_id]
+        if len(older) >= limit:
+            return older[-limit:], len(older) > limit or not complete
+        if complete:
+            return older, False
+        return None
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+import numpy as np
+
+from frames import MIX_SPEAKER, audio_level, pack_frame
+
+class SampleFifo:
+    """Fixed-capacity int16 sample queue that drops the oldest samples on overflow."""
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.size = 0
+
+    def push(self, samples):
+        capacity = len(self.buffer)
+        if len(samples) >= capacity:
+            self.buffer[:] = samples[-capacity:]
+            self.size = capacity
+            return
+        overflow = self.size + len(samples) - capacity
+        if overflow > 0:
+            self.buffer[:self.size - overflow] = self.buffer[overflow:self.size]
+            self.size -= overflow
+        self.buffer[self.size:self.size + len(samples)] = samples
+        self.size += len(samples)
+
+    def pop(self, count):
+        """Return up to count samples as int32, zero-padded to count."""
+        frame = np.zeros(count, dtype=np.int32)
+        taken = min(count, self.size)
+        frame[:taken] = self.buffer[:taken]
+        self.buffer[:self.size - taken] = self.buffer[taken:self.size]
+        self.size -= taken
+        return frame
+
+class MixedFrame:
+    """One tick of mixed audio, encoded at most once per codec."""
+
+    def __init__(self, mix, sequence, timestamp):
+        self.samples = np.clip(mix, -32768, 32767).astype(np.int16)
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.level = audio_level(self.samples)
+        self._encoded = {}
+
+    def encode(self, codec):
+        frame = self._encoded.get(codec.codec_id)
+        if frame is None:
+            frame = pack_frame(codec.codec_id, self.sequence, self.timestamp, self.level, codec.encode(self.samples), MIX_SPEAKER)
+            self._encoded[codec.codec_id] = frame
+        return frame
+
+class RoomMixer:
+    """Mixes a room's talkers into one "everyone but you" stream per listener.
+
+    Talkers push decoded int16 samples as they arrive. Every tick the mixer takes one
+    tick's worth of samples from each talker, sums them once, and gives each
+    listener the total minus their own contribution. Listeners who are not
+    talking all share the same MixedFrame. Output frames carry the
+    MIX_SPEAKER slot and the mixer's own sequence numbers.
+    """
+
+    def __init__(self, sample_rate=8000, tick_ms=20, max_buffer_ms=200):
+        self.frame_samples = sample_rate * tick_ms // 1000
+        self.capacity = max(self.frame_samples, sample_rate * max_buffer_ms // 1000)
+        self.tick_ms = tick_ms
+        self.talkers = {}  # client id -> SampleFifo
+        self.sequence = 0
+        self.timestamp = 0
+
+    def push(self, client_id, samples):
+        fifo = self.talkers.get(client_id)
+        if fifo is None:
+            fifo = self.talkers[client_id] = SampleFifo(self.capacity)
+        fifo.push(samples)
+
+    def tick(self, members):
+        """Mix one tick for members.
+
+        Returns (shared_frame, personal_frames) as MixedFrames: shared_frame is for members
+        who did not talk this tick (None if nobody talked) and
+        personal_frames maps each talker to their N-1 mix, or None when they
+        were the only talker.
+        """
+        members = set(members)
+        for client_id in list(self.talkers):
+            if client_id not in members or self.talkers[client_id].size == 0:
+                del self.talkers[client_id]
+        if not self.talkers:
+            return None, {}
+
+        contributions = {client_id: fifo.pop(self.frame_samples) for client_id, fifo in self.talkers.items()}
+        total = np.sum(list(contributions.values()), axis=0)
+        shared_frame = MixedFrame(total, self.sequence, self.timestamp)
+
+        personal_frames = {}
+        for client_id, contribution in contributions.items():
+            if len(contributions) == 1:
+                personal_frames[client_id] = None
+            else:
+                personal_frames[client_id] = MixedFrame(total - contribution, self.sequence, self.timestamp)
+
+        self.sequence += 1
+        self.timestamp += self.tick_ms
+        return shared_frame, personal_frames
+
+async def run_mixers(mixers, tick_ms, members_of, deliver):
+    """Tick every room mixer on a fixed clock and hand the output to deliver(room_name, shared, personal)."""
+    loop = asyncio.get_running_loop()
+    interval = tick_ms / 1000
+    next_tick = loop.time()
+    while True:
+        next_tick += interval
+        for room_name, mixer in mixers.items():
+            try:
+                shared_frame, personal_frames = mixer.tick(members_of(room_name))
+                if shared_frame is not None:
+                    deliver(room_name, shared_frame, personal_frames)
+            except Exception as e:
+                logging.error(f"Mixer tick for {room_name} failed: {e}")
+        delay = next_tick - loop.time()
+        if delay < 0:
+            # Fell behind; skip the missed ticks instead of bursting.
+            next_tick = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
@@ -0,0 +1,44 @@
+import asyncio
+
+class PresencePublisher:
+    """Coalesces presence changes into one update per client per window.
+
+    Membership changes mark their room dirty and room list events are
+    queued. window_ms after the first change, every dirty room gets a
+    single room_update and the queued events go out together, so a burst
+    of joins costs one broadcast per room instead of one per join.
+    A window of 0 publishes every change immediately.
+    """
+
+    def __init__(self, window_ms, send_room_updates, send_events):
+        self.window = window_ms / 1000
+        self.send_room_updates = send_room_updates  # callable(room names)
+        self.send_events = send_events  # callable(list of events)
+        self.dirty_rooms = set()
+        self.events = []
+        self.flush_handle = None
+
+    def room_changed(self, room_name):
+        self.dirty_rooms.add(room_name)
+        self._schedule()
+
+    def add_event(self, event):
+        self.events.append(event)
+        self._schedule()
+
+    def _schedule(self):
+        if self.window <= 0:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        rooms, self.dirty_rooms = self.dirty_rooms, set()
+        events, self.events = self.events, []
+        if rooms:
+            self.send_room_updates(rooms)
+        if events:
+            self.send_events(events)
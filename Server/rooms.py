@@ -0,0 +1,70 @@
+class RoomRegistry:
+    """In-memory room membership, the single source of truth for who is where.
+
+    SQLite only keeps durable room metadata. Membership changes on every
+    join/switch/leave and is read on every audio frame, so it lives here
+    instead of in the database. Room metadata is cached here as well, so
+    room switches and room list snapshots never touch SQLite; handlers that
+    change the rooms table update the cache alongside it.
+    """
+
+    def __init__(self):
+        self._members = {}  # room name -> set of client ids
+        self._rooms = {}    # client id -> room name
+        self._info = {}     # room name -> password (None when open)
+        self._ids = {}      # room name -> rooms.id
+
+    def load_rooms(self, rows):
+        """Fill the metadata cache from (id, name, password) rows."""
+        self._info = {name: password for _, name, password in rows}
+        self._ids = {name: room_id for room_id, name, _ in rows}
+
+    def add_room(self, room_name, password=None, room_id=None):
+        """Add or update a room; room_id is only needed when the room is new."""
+        self._info[room_name] = password
+        if room_id is not None:
+            self._ids[room_name] = room_id
+
+    def remove_room(self, room_name):
+        self._info.pop(room_name, None)
+        self._ids.pop(room_name, None)
+
+    def room_id(self, room_name):
+        return self._ids.get(room_name)
+
+    def has_room(self, room_name):
+        return room_name in self._info
+
+    def room_password(self, room_name):
+        return self._info.get(room_name)
+
+    def room_names(self):
+        return list(self._info)
+
+    def join(self, client_id, room_name):
+        """Put client_id in room_name and return the room it left, if any."""
+        previous_room = self.leave(client_id)
+        self._members.setdefault(room_name, set()).add(client_id)
+        self._rooms[client_id] = room_name
+        return previous_room
+
+    def leave(self, client_id):
+        """Remove client_id from its room and return that room's name."""
+        room_name = self._rooms.pop(client_id, None)
+        if room_name is not None:
+            members = self._members.get(room_name)
+            if members is not None:
+                members.discard(client_id)
+                if not members:
+                    del self._members[room_name]
+        return room_name
+
+    def room_of(self, client_id):
+        return self._rooms.get(client_id)
+
+    def members(self, room_name):
+        """Snapshot of the client ids in room_name, safe to iterate across awaits."""
+        return tuple(self._members.get(room_name, ()))
+
+    def __contains__(self, client_id):
+        return client_id in self._rooms
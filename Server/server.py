@@ -1,18 +1,31 @@
 import asyncio
 import websockets
 import json
-import sqlite3
 import uuid
 import logging
 import ssl
+import signal
+import threading
+import time
 from database import init_db, ensure_default_rooms, create_initial_admin, create_initial_privilege_key
 
 # Local imports
 import database
 import backup
 import config_loader
+from rooms import RoomRegistry
+from presence import PresencePublisher
+from history import RecentMessages
+from broadcast import Outbox, broadcast, broadcast_json, encode_json, log_fanout_stats
+from mixer import RoomMixer, run_mixers
+from frames import MIX_SPEAKER, MAX_SPEAKER, unpack_frame, set_speaker
+from voice_codec import codec_by_id, negotiate_codec
 
 clients = {}
+room_registry = RoomRegistry()
+room_mixers = {}
+free_speaker_slots = list(range(MAX_SPEAKER, MIX_SPEAKER, -1))
+room_list_seq = 0  # sequence number of the last room list event
 
 # loads the config file
 config = config_loader.load_config('config.json')
@@ -28,6 +41,11 @@ max_users = config.get('server', {}).get('max_users', 100)
 # Extract database settings
 db_file = config.get('database', {}).get('db_file', 'DB/pyspeak.db')
 
+chat_flush_ms = config.get('database', {}).get('chat_flush_ms', 50)
+chat_batch_size = config.get('database', {}).get('chat_batch_size', 100)
+shutdown_flush_seconds = config.get('database', {}).get('shutdown_flush_seconds', 5)
+persist_membership = config.get('database', {}).get('persist_membership', False)
+
 # Extract logging settings
 log_level = config.get('logging', {}).get('level', 'INFO').upper()
 log_file = config.get('logging', {}).get('log_file', 'server.log')
@@ -44,6 +62,24 @@ max_requests_per_minute = config.get('rate_limiting', {}).get('max_requests_per_
 # Extract room settings
 default_room = config.get('rooms', {}).get('default_room', 'Lobby')
 default_room_password = config.get('rooms', {}).get('default_room_password', None)
+mixed_rooms = config.get('rooms', {}).get('mixed_rooms', [])
+
+# Extract audio settings
+outbound_queue_frames = config.get('audio', {}).get('outbound_queue_frames', 32)
+sample_rate = config.get('audio', {}).get('sample_rate', 8000)
+preferred_codecs = config.get('audio', {}).get('codecs', ['ulaw', 'pcm16'])
+mixer_tick_ms = config.get('audio', {}).get('mixer_tick_ms', 20)
+
+# Extract presence settings
+presence_coalesce_ms = config.get('presence', {}).get('coalesce_ms', 50)
+
+# Extract chat history settings
+history_recent_messages = config.get('history', {}).get('recent_messages', 50)
+history_page_size = config.get('history', {}).get('page_size', 50)
+history_max_page_size = config.get('history', {}).get('max_page_size', 200)
+
+# Extract monitoring settings
+stats_interval_seconds = config.get('monitoring', {}).get('stats_interval_seconds', 60)
 
 # Extract backup settings
 backup_enabled = config.get('backup', {}).get('enabled', True)
@@ -54,12 +90,22 @@ backup_folder = config.get('backup', {}).get('backup_folder', 'backups/')
 logging.basicConfig(filename=log_file, level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info('Server started')
 
-def get_db_connection():
-    return sqlite3.connect(db_file)
+db = database.Database(db_file)
+recent_messages = RecentMessages(history_recent_messages)
+
+def room_outboxes(room_name, exclude=None):
+    return [clients[member_id]['outbox'] for member_id in room_registry.members(room_name)
+            if member_id != exclude and member_id in clients]
+
+def send_json(client_id, payload):
+    clients[client_id]['outbox'].put_control(encode_json(payload))
 
 async def handler(websocket, path):
     client_id = str(uuid.uuid4())
-    clients[client_id] = {'websocket': websocket, 'room': None, 'username': None}
+    outbox = Outbox(websocket, outbound_queue_frames)
+    speaker_slot = free_speaker_slots.pop() if free_speaker_slots else None
+    clients[client_id] = {'websocket': websocket, 'outbox': outbox, 'username': None, 'slot': speaker_slot}
+    writer = asyncio.create_task(outbox.run())
 
     try:
         async for message in websocket:
@@ -71,24 +117,41 @@ async def handler(websocket, path):
     except websockets.ConnectionClosed:
         print(f"Client {client_id} disconnected")
     finally:
+        outbox.close()
+        writer.cancel()
         await remove_client_from_room(client_id)
+        if speaker_slot is not None:
+            free_speaker_slots.append(speaker_slot)
 
 async def remove_client_from_room(client_id):
-    if client_id in clients and clients[client_id]['room']:
-        room_name = clients[client_id]['room']
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT members FROM rooms WHERE name=?", (room_name,))
-        members = json.loads(cursor.fetchone()[0])
-        if client_id in members:
-            members.remove(client_id)
-            cursor.execute("UPDATE rooms SET members=? WHERE name=?", (json.dumps(members), room_name))
-            conn.commit()
-            await update_room_members(room_name)
-            await update_room_list()
-        conn.close()
-    if client_id in clients:
-        del clients[client_id]
+    room_name = room_registry.leave(client_id)
+    client = clients.pop(client_id, None)
+    if room_name:
+        if client is not None:
+            store_membership(client.get('user_id'), previous_room=room_name)
+        presence.room_changed(room_name)
+        if client is not None:
+            publish_room_event({'type': 'user_left', 'room': room_name, 'username': client['username']})
+
+def store_membership(user_id, room_name=None, previous_room=None):
+    """Mirror a membership change into room_members when persist_membership is on.
+
+    room_registry stays the source of truth; the table is for tools and
+    reports that want to see who is where. A user with several connections
+    keeps their row until the last of them leaves the room. The writes are
+    queued without awaiting them, so nothing can run between a membership
+    change and the room event that announces it.
+    """
+    if not persist_membership or user_id is None:
+        return
+    if previous_room and previous_room != room_name and room_registry.has_room(previous_room):
+        if not any(clients[member_id].get('user_id') == user_id
+                   for member_id in room_registry.members(previous_room) if member_id in clients):
+            db.submit("DELETE FROM room_members WHERE room_id=? AND user_id=?",
+                      (room_registry.room_id(previous_room), user_id))
+    if room_name:
+        db.submit("INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)",
+                  (room_registry.room_id(room_name), user_id))
 
 async def process_message(client_id, data):
     message_type = data['type']
@@ -119,6 +182,11 @@ async def process_message(client_id, data):
         await handle_use_privilege_key(client_id, data)
     elif message_type == 'move_user':
         await handle_move_user(client_id, data)
+    elif message_type == 'history':
+        await handle_history(client_id, data)
+    elif message_type == 'room_list_resync':
+        if client_id in room_registry:
+            send_room_list(client_id)
 
 async def handle_join(client_id, data, first_time=False):
     username = data['username']
@@ -126,415 +194,400 @@ async def handle_join(client_id, data, first_time=False):
     room_name = data.get('room', 'Lobby')
 
     if server_password and server_password != data.get('password'):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'Invalid server password'}))
+        send_json(client_id, {'type': 'error', 'message': 'Invalid server password'})
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM users WHERE uid=?", (uid,))
-    user = cursor.fetchone()
-
-    if not user:
-        cursor.execute("INSERT INTO users (uid, username, password, role, is_superadmin) VALUES (?, ?, ?, ?, ?)",
-                       (uid, username, 'default_password', 'user', False))
-        conn.commit()
-        cursor.execute("SELECT * FROM users WHERE uid=?", (uid,))
-        user = cursor.fetchone()
+    user = await db.fetch_or_insert("SELECT * FROM users WHERE uid=?", (uid,),
+                                    "INSERT OR IGNORE INTO users (uid, username, password, role, is_superadmin) VALUES (?, ?, ?, ?, ?)",
+                                    (uid, username, 'default_password', 'user', False))
 
     clients[client_id]['username'] = username
     clients[client_id]['uid'] = uid
+    clients[client_id]['user_id'] = user[0]
     clients[client_id]['role'] = user[4]  # Assuming role is the 5th column
 
-    cursor.execute("SELECT * FROM rooms WHERE name=?", (room_name,))
-    room = cursor.fetchone()
-
-    if not room:
-        cursor.execute("INSERT INTO rooms (name, members) VALUES (?, ?)", (room_name, json.dumps([])))
-        conn.commit()
-        cursor.execute("SELECT * FROM rooms WHERE name=?", (room_name,))
-        room = cursor.fetchone()
+    if not room_registry.has_room(room_name):
+        # Registered before the await so a concurrent joiner does not create it again.
+        room_registry.add_room(room_name)
+        publish_room_event({'type': 'room_created', 'room': room_name, 'password': None})
+        room = await db.fetch_or_insert("SELECT id FROM rooms WHERE name=?", (room_name,),
+                                        "INSERT OR IGNORE INTO rooms (name) VALUES (?)", (room_name,))
+        room_registry.add_room(room_name, room_id=room[0])
 
-    members = json.loads(room[3])
-    members.append(client_id)
-    cursor.execute("UPDATE rooms SET members=? WHERE name=?", (json.dumps(members), room_name))
-    conn.commit()
+    previous_room = room_registry.join(client_id, room_name)
+    store_membership(user[0], room_name, previous_room)
 
-    clients[client_id]['room'] = room_name
+    codec = negotiate_codec(data.get('codecs', ['pcm16']), preferred_codecs)
+    clients[client_id]['codec'] = codec
+    send_json(client_id, {'type': 'audio_format', 'codec': codec.name, 'sample_rate': sample_rate})
 
     if first_time:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': welcome_message}))
+        send_json(client_id, {'type': 'info', 'message': welcome_message})
 
-    await clients[client_id]['websocket'].send(json.dumps({
+    send_json(client_id, {
         'type': 'info',
         'message': f"Welcome to {room_name}, {username}!",
         'role': user[4]  # Skicka användarens roll till klienten
-    }))
+    })
 
-    conn.close()
-    await update_room_members(room_name)
-    await update_room_list()
+    if previous_room:
+        presence.room_changed(previous_room)
+        publish_room_event({'type': 'user_moved', 'username': username, 'from': previous_room, 'to': room_name})
+    else:
+        publish_room_event({'type': 'user_joined', 'room': room_name, 'username': username})
+    send_room_list(client_id)
+    presence.room_changed(room_name)
+    await send_history(client_id, room_name)
 
 async def handle_audio(client_id, audio_data):
-    room_name = clients[client_id]['room']
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT members FROM rooms WHERE name=?", (room_name,))
-    members = json.loads(cursor.fetchone()[0])
-    
-    for member_id in members:
-        if member_id != client_id and clients[member_id]['websocket'].open:
-            await clients[member_id]['websocket'].send(audio_data)
-    conn.close()
+    room_name = room_registry.room_of(client_id)
+    speaker_slot = clients[client_id]['slot']
+    if room_name is None or speaker_slot is None:
+        return
+
+    try:
+        header, payload = unpack_frame(audio_data)
+    except ValueError as e:
+        logging.debug(f"Dropping audio from {client_id}: {e}")
+        return
+
+    mixer = room_mixers.get(room_name)
+    if mixer is not None:
+        codec = codec_by_id(header.codec)
+        if codec is not None:
+            try:
+                samples = codec.decode(payload)
+            except ValueError as e:
+                # e.g. an odd-length PCM16 payload
+                logging.debug(f"Dropping audio from {client_id}: {e}")
+                return
+            mixer.push(client_id, samples)
+        return
+
+    broadcast(room_outboxes(room_name, exclude=client_id), set_speaker(audio_data, speaker_slot), room_name, audio=True)
+
+def deliver_mixed_audio(room_name, shared_frame, personal_frames):
+    listeners = {}  # codec -> outboxes that get the shared mix
+    for member_id in room_registry.members(room_name):
+        client = clients.get(member_id)
+        if client is None or 'codec' not in client:
+            continue
+        if member_id in personal_frames:
+            if personal_frames[member_id] is not None:
+                broadcast([client['outbox']], personal_frames[member_id].encode(client['codec']), room_name, audio=True)
+        else:
+            listeners.setdefault(client['codec'], []).append(client['outbox'])
+    for codec, outboxes in listeners.items():
+        broadcast(outboxes, shared_frame.encode(codec), room_name, audio=True)
 
 async def handle_talking(client_id, data):
-    room_name = clients[client_id]['room']
+    room_name = room_registry.room_of(client_id)
     is_talking = data['status']
     username = clients[client_id]['username']
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT members FROM rooms WHERE name=?", (room_name,))
-    members = json.loads(cursor.fetchone()[0])
 
-    for member_id in members:
-        if clients[member_id]['websocket'].open:
-            await clients[member_id]['websocket'].send(json.dumps({'type': 'talking', 'username': username, 'status': is_talking}))
-    conn.close()
+    broadcast_json(room_outboxes(room_name), {'type': 'talking', 'username': username, 'status': is_talking}, room_name)
 
 async def handle_message(client_id, data):
-    room_name = clients[client_id]['room']
+    room_name = room_registry.room_of(client_id)
     message = data['message']
     username = clients[client_id]['username']
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM rooms WHERE name=?", (room_name,))
-    room_id = cursor.fetchone()[0]
-    cursor.execute("SELECT id FROM users WHERE username=?", (username,))
-    user_id = cursor.fetchone()[0]
-
-    cursor.execute("INSERT INTO messages (room_id, user_id, message) VALUES (?, ?, ?)", (room_id, user_id, message))
-    conn.commit()
+    room_id = room_registry.room_id(room_name)
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
 
-    cursor.execute("SELECT members FROM rooms WHERE name=?", (room_name,))
-    members = json.loads(cursor.fetchone()[0])
+    # Saved by the write-behind queue; delivery does not wait for the disk.
+    message_id = message_writer.add(room_id, clients[client_id]['user_id'], message, timestamp)
+    recent_messages.add(room_id, {'id': message_id, 'username': username, 'message': message, 'timestamp': timestamp})
 
-    for member_id in members:
-        if clients[member_id]['websocket'].open:
-            await clients[member_id]['websocket'].send(json.dumps({'type': 'message', 'username': username, 'message': message}))
-    conn.close()
+    broadcast_json(room_outboxes(room_name), {'type': 'message', 'id': message_id, 'username': username, 'message': message}, room_name)
 
 async def handle_private_message(client_id, data):
     recipient = data['recipient']
     message = data['message']
     username = clients[client_id]['username']
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT uid FROM users WHERE username=?", (recipient,))
-    recipient_uid = cursor.fetchone()
+    recipient_uid = await db.fetchone("SELECT uid FROM users WHERE username=?", (recipient,))
 
     if recipient_uid:
         recipient_uid = recipient_uid[0]
         if recipient_uid in clients and clients[recipient_uid]['websocket'].open:
-            await clients[recipient_uid]['websocket'].send(json.dumps({'type': 'private_message', 'username': username, 'message': message}))
-    conn.close()
+            send_json(recipient_uid, {'type': 'private_message', 'username': username, 'message': message})
 
 async def handle_switch_room(client_id, data):
     new_room_name = data['new_room']
-    current_room_name = clients[client_id]['room']
+    current_room_name = room_registry.room_of(client_id)
     room_password = data.get('room_password', None)
 
     if new_room_name == current_room_name:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"You are already in {new_room_name}."}))
+        send_json(client_id, {'type': 'error', 'message': f"You are already in {new_room_name}."})
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # Kontrollera om det nya rummet finns
-    cursor.execute("SELECT * FROM rooms WHERE name=?", (new_room_name,))
-    room = cursor.fetchone()
-
-    if not room:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"Room {new_room_name} does not exist."}))
-        conn.close()
+    if not room_registry.has_room(new_room_name):
+        send_json(client_id, {'type': 'error', 'message': f"Room {new_room_name} does not exist."})
         return
 
     # Kontrollera lösenord om det finns
-    if room[2] and room[2] != room_password:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'password_required', 'room': new_room_name}))
-        conn.close()
+    required_password = room_registry.room_password(new_room_name)
+    if required_password and required_password != room_password:
+        send_json(client_id, {'type': 'password_required', 'room': new_room_name})
         return
 
-    # Ta bort användaren från det nuvarande rummet
+    # Flytta användaren till det nya rummet
+    room_registry.join(client_id, new_room_name)
+    store_membership(clients[client_id].get('user_id'), new_room_name, current_room_name)
     if current_room_name:
-        cursor.execute("SELECT members FROM rooms WHERE name=?", (current_room_name,))
-        current_room_members = json.loads(cursor.fetchone()[0])
-        if client_id in current_room_members:
-            current_room_members.remove(client_id)
-            cursor.execute("UPDATE rooms SET members=? WHERE name=?", (json.dumps(current_room_members), current_room_name))
-            await update_room_members(current_room_name)
+        presence.room_changed(current_room_name)
+    presence.room_changed(new_room_name)
 
-    # Lägg till användaren i det nya rummet
-    cursor.execute("SELECT members FROM rooms WHERE name=?", (new_room_name,))
-    new_room_members = json.loads(cursor.fetchone()[0])
-    new_room_members.append(client_id)
-    cursor.execute("UPDATE rooms SET members=? WHERE name=?", (json.dumps(new_room_members), new_room_name))
-    conn.commit()
+    # Skicka uppdatering om rumsbytet till klienten
+    send_json(client_id, {'type': 'switched_room', 'message': f'Switched to room: {new_room_name}'})
+    publish_room_event({'type': 'user_moved', 'username': clients[client_id]['username'], 'from': current_room_name, 'to': new_room_name})
+    await send_history(client_id, new_room_name)
 
-    clients[client_id]['room'] = new_room_name
-    await update_room_members(new_room_name)
+async def handle_history(client_id, data):
+    room_name = room_registry.room_of(client_id)
+    if not room_name:
+        return
 
-    conn.close()
+    try:
+        before_id = data.get('before')
+        before_id = int(before_id) if before_id is not None else None
+        limit = min(max(int(data.get('limit', history_page_size)), 1), history_max_page_size)
+    except (TypeError, ValueError):
+        send_json(client_id, {'type': 'error', 'message': 'Invalid history request.'})
+        return
 
-    # Skicka uppdatering om rumsbytet till klienten
-    await clients[client_id]['websocket'].send(json.dumps({'type': 'switched_room', 'message': f'Switched to room: {new_room_name}'}))
-    await update_room_list()
+    await send_history(client_id, room_name, before_id, limit)
+
+async def send_history(client_id, room_name, before_id=None, limit=history_page_size):
+    """Send up to limit messages of room_name older than before_id (the newest when None)."""
+    room_id = room_registry.room_id(room_name)
+    page = recent_messages.page(room_id, before_id, limit)
+    if page is not None:
+        messages, more = page
+    else:
+        # Messages still in the write-behind queue have to be on disk before we page past them.
+        if message_writer.pending:
+            await message_writer.flush()
+        if before_id is None:
+            before_id = message_writer.last_id + 1
+        rows = await db.fetchall(database.HISTORY_QUERY, (room_id, before_id, limit + 1))
+        messages = [history_entry(row) for row in reversed(rows[:limit])]
+        more = len(rows) > limit
+
+    if client_id in clients:
+        send_json(client_id, {'type': 'history', 'room': room_name, 'messages': messages, 'more': more})
+
+def history_entry(row):
+    message_id, username, message, timestamp = row
+    return {'id': message_id, 'username': username, 'message': message, 'timestamp': timestamp}
 
 async def handle_create_room(client_id, data):
     if clients[client_id]['role'] not in ['admin', 'superadmin']:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to create rooms.'}))
+        send_json(client_id, {'type': 'error', 'message': 'You do not have permission to create rooms.'})
         return
 
     room_name = data['room_name']
     room_password = data.get('room_password', None)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM rooms WHERE name=?", (room_name,))
-    room = cursor.fetchone()
 
-    if room:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"Room {room_name} already exists."}))
+    if room_registry.has_room(room_name):
+        send_json(client_id, {'type': 'error', 'message': f"Room {room_name} already exists."})
     else:
-        cursor.execute("INSERT INTO rooms (name, password, members) VALUES (?, ?, ?)", (room_name, room_password, json.dumps([])))
-        conn.commit()
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"Room {room_name} created."}))
-        await update_room_list()
-    conn.close()
+        room_registry.add_room(room_name, room_password)
+        room = await db.fetch_or_insert("SELECT id FROM rooms WHERE name=?", (room_name,),
+                                        "INSERT OR IGNORE INTO rooms (name, password) VALUES (?, ?)", (room_name, room_password))
+        room_registry.add_room(room_name, room_password, room[0])
+        send_json(client_id, {'type': 'info', 'message': f"Room {room_name} created."})
+        publish_room_event({'type': 'room_created', 'room': room_name, 'password': room_password})
 
 async def handle_edit_room(client_id, data):
     logging.info(f"handle_edit_room: Received data: {data}")
     if not await is_admin(client_id):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to edit rooms.'}))
+        send_json(client_id, {'type': 'error', 'message': 'You do not have permission to edit rooms.'})
         return
 
     room_name = data.get('room_name')
     room_password = data.get('room_password', None)
     
     if not room_name:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'Invalid room name.'}))
+        send_json(client_id, {'type': 'error', 'message': 'Invalid room name.'})
         return
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM rooms WHERE name=?", (room_name,))
-    room = cursor.fetchone()
+    room = await db.fetchone("SELECT * FROM rooms WHERE name=?", (room_name,))
 
     if room:
-        cursor.execute("UPDATE rooms SET password=? WHERE name=?", (room_password, room_name))
-        conn.commit()
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"Room {room_name} updated."}))
-        await update_room_list()
+        await db.execute("UPDATE rooms SET password=? WHERE name=?", (room_password, room_name))
+        send_json(client_id, {'type': 'info', 'message': f"Room {room_name} updated."})
+        room_registry.add_room(room_name, room_password)
+        publish_room_event({'type': 'room_updated', 'room': room_name, 'password': room_password})
     else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"Room {room_name} does not exist."}))
-    conn.close()
+        send_json(client_id, {'type': 'error', 'message': f"Room {room_name} does not exist."})
 
 async def handle_delete_room(client_id, data):
     logging.info(f"handle_delete_room: Received data: {data}")
     if not await is_admin(client_id):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to delete rooms.'}))
+        send_json(client_id, {'type': 'error', 'message': 'You do not have permission to delete rooms.'})
         return
 
     room_name = data.get('room_name')
     
     if not room_name:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'Invalid room name.'}))
+        send_json(client_id, {'type': 'error', 'message': 'Invalid room name.'})
         return
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM rooms WHERE name=?", (room_name,))
-    room = cursor.fetchone()
+    room = await db.fetchone("SELECT * FROM rooms WHERE name=?", (room_name,))
 
     if room:
-        cursor.execute("DELETE FROM rooms WHERE name=?", (room_name,))
-        conn.commit()
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"Room {room_name} deleted."}))
-        await update_room_list()
+        await db.execute("DELETE FROM room_members WHERE room_id=?", (room_registry.room_id(room_name),))
+        recent_messages.remove_room(room_registry.room_id(room_name))
+        await db.execute("DELETE FROM rooms WHERE name=?", (room_name,))
+        send_json(client_id, {'type': 'info', 'message': f"Room {room_name} deleted."})
+        room_registry.remove_room(room_name)
+        publish_room_event({'type': 'room_deleted', 'room': room_name})
     else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"Room {room_name} does not exist."}))
-    conn.close()
+        send_json(client_id, {'type': 'error', 'message': f"Room {room_name} does not exist."})
 
 async def handle_ban(client_id, data):
     if not await is_admin(client_id):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to ban users.'}))
+        send_json(client_id, {'type': 'error', 'message': 'You do not have permission to ban users.'})
         return
 
     username_to_ban = data['username']
     reason = data.get('reason', 'No reason provided')
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE username=?", (username_to_ban,))
-    user_id_to_ban = cursor.fetchone()
+    user_id_to_ban = await db.fetchone("SELECT id FROM users WHERE username=?", (username_to_ban,))
 
     if user_id_to_ban:
         user_id_to_ban = user_id_to_ban[0]
-        cursor.execute("INSERT INTO bans (user_id, reason) VALUES (?, ?)", (user_id_to_ban, reason))
-        conn.commit()
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"{username_to_ban} has been banned."}))
+        await db.execute("INSERT INTO bans (user_id, reason) VALUES (?, ?)", (user_id_to_ban, reason))
+        send_json(client_id, {'type': 'info', 'message': f"{username_to_ban} has been banned."})
 
         for uid, client in clients.items():
             if client['username'] == username_to_ban:
                 await remove_client_from_room(uid)
                 await client['websocket'].close()
     else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"User {username_to_ban} not found."}))
-    conn.close()
+        send_json(client_id, {'type': 'error', 'message': f"User {username_to_ban} not found."})
 
 async def handle_kick(client_id, data):
     if not await is_admin(client_id):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to kick users.'}))
+        send_json(client_id, {'type': 'error', 'message': 'You do not have permission to kick users.'})
         return
 
     username_to_kick = data['username']
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT uid FROM users WHERE username=?", (username_to_kick,))
-    user_uid_to_kick = cursor.fetchone()
+    user_uid_to_kick = await db.fetchone("SELECT uid FROM users WHERE username=?", (username_to_kick,))
 
     if user_uid_to_kick:
         user_uid_to_kick = user_uid_to_kick[0]
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"{username_to_kick} has been kicked."}))
+        send_json(client_id, {'type': 'info', 'message': f"{username_to_kick} has been kicked."})
 
         if user_uid_to_kick in clients:
             await remove_client_from_room(user_uid_to_kick)
             await clients[user_uid_to_kick]['websocket'].close()
     else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"User {username_to_kick} not found."}))
-    conn.close()
+        send_json(client_id, {'type': 'error', 'message': f"User {username_to_kick} not found."})
 
 async def handle_move_user(client_id, data):
     if not await is_admin(client_id):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to move users.'}))
+        send_json(client_id, {'type': 'error', 'message': 'You do not have permission to move users.'})
         return
 
     username_to_move = data['username']
     new_room_name = data['room_name']
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT uid FROM users WHERE username=?", (username_to_move,))
-    user_uid_to_move = cursor.fetchone()
+    user_uid_to_move = await db.fetchone("SELECT uid FROM users WHERE username=?", (username_to_move,))
 
     if user_uid_to_move:
         user_uid_to_move = user_uid_to_move[0]
         if user_uid_to_move in clients:
             await handle_switch_room(user_uid_to_move, {'new_room': new_room_name})
-            await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"{username_to_move} has been moved to {new_room_name}."}))
+            send_json(client_id, {'type': 'info', 'message': f"{username_to_move} has been moved to {new_room_name}."})
         else:
-            await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"User {username_to_move} is not online."}))
+            send_json(client_id, {'type': 'error', 'message': f"User {username_to_move} is not online."})
     else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"User {username_to_move} not found."}))
-    conn.close()
-
-    if not await is_admin(client_id):
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'You do not have permission to move users.'}))
-        return
-
-    username_to_move = data['username']
-    new_room_name = data['room_name']
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT uid FROM users WHERE username=?", (username_to_move,))
-    user_uid_to_move = cursor.fetchone()
-
-    if user_uid_to_move:
-        user_uid_to_move = user_uid_to_move[0]
-        if user_uid_to_move in clients:
-            await handle_switch_room(user_uid_to_move, {'new_room': new_room_name})
-            await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f"{username_to_move} has been moved to {new_room_name}."}))
-        else:
-            await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"User {username_to_move} is not online."}))
-    else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': f"User {username_to_move} not found."}))
-    conn.close()
+        send_json(client_id, {'type': 'error', 'message': f"User {username_to_move} not found."})
 
 async def handle_use_privilege_key(client_id, data):
     privilege_key = data['key']
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM privilege_keys WHERE key=?", (privilege_key,))
-    result = cursor.fetchone()
+    result = await db.fetchone("SELECT role FROM privilege_keys WHERE key=?", (privilege_key,))
 
     if result:
         role = result[0]
-        cursor.execute("UPDATE users SET role=? WHERE uid=?", (role, clients[client_id]['uid']))
-        conn.commit()
+        await db.execute("UPDATE users SET role=? WHERE uid=?", (role, clients[client_id]['uid']))
         clients[client_id]['role'] = role  # Update role in clients dictionary
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'info', 'message': f'Privilege key used. Role updated to {role}.'}))
+        send_json(client_id, {'type': 'info', 'message': f'Privilege key used. Role updated to {role}.'})
     else:
-        await clients[client_id]['websocket'].send(json.dumps({'type': 'error', 'message': 'Invalid privilege key.'}))
-
-    conn.close()
+        send_json(client_id, {'type': 'error', 'message': 'Invalid privilege key.'})
 
-def get_user_role(uid):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE uid=?", (uid,))
-    role = cursor.fetchone()
-    conn.close()
+async def get_user_role(uid):
+    role = await db.fetchone("SELECT role FROM users WHERE uid=?", (uid,))
     return role[0] if role else None
 
 async def is_admin(client_id):
     uid = clients[client_id]['uid']
-    role = get_user_role(uid)
+    role = await get_user_role(uid)
     return role in ['admin', 'superadmin']
 
-async def update_room_members(room_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT members FROM rooms WHERE name=?", (room_name,))
-    members = json.loads(cursor.fetchone()[0])
-    
-    # Endast inkludera medlemmar som fortfarande är anslutna
-    member_details = [{'username': clients[client_id]['username'], 'id': client_id} for client_id in members if client_id in clients]
-
-    for member_id in members:
-        if member_id in clients and clients[member_id]['websocket'].open:
-            await clients[member_id]['websocket'].send(json.dumps({'type': 'room_update', 'members': member_details}))
-    conn.close()
-
-async def update_room_list():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, password, members FROM rooms")
-    rooms = cursor.fetchall()
-    
+def publish_room_updates(room_names):
+    for room_name in room_names:
+        # Endast inkludera medlemmar som fortfarande är anslutna
+        member_details = [{'username': clients[client_id]['username'], 'id': client_id, 'slot': clients[client_id]['slot']}
+                          for client_id in room_registry.members(room_name) if client_id in clients]
+
+        broadcast_json(room_outboxes(room_name), {'type': 'room_update', 'members': member_details}, room_name)
+
+def send_room_list(client_id):
+    """Full room list snapshot for one client, on join and when it asks for a resync."""
     room_list = {}
-    for room in rooms:
-        room_name = room[0]
-        room_password = room[1]
-        room_members = json.loads(room[2])
-        
+    for room_name in room_registry.room_names():
         # Endast inkludera medlemmar som fortfarande är anslutna
-        valid_members = [clients[client_id]['username'] for client_id in room_members if client_id in clients]
-        room_list[room_name] = {'members': valid_members, 'password': room_password}
-    
-    for client in clients.values():
-        if client['websocket'].open:
-            await client['websocket'].send(json.dumps({'type': 'room_list', 'rooms': room_list, 'server_name': server_name}))
-    conn.close()
+        valid_members = [clients[member_id]['username'] for member_id in room_registry.members(room_name) if member_id in clients]
+        room_list[room_name] = {'members': valid_members, 'password': room_registry.room_password(room_name)}
+
+    send_json(client_id, {'type': 'room_list', 'seq': room_list_seq, 'rooms': room_list, 'server_name': server_name})
+
+def publish_room_event(event):
+    """Number a room list change and queue it for the next presence flush.
+
+    A client that sees a gap in the numbers asks for a fresh snapshot with
+    room_list_resync; events its snapshot already covers are ignored.
+    """
+    global room_list_seq
+    room_list_seq += 1
+    event['seq'] = room_list_seq
+    presence.add_event(event)
+
+def send_room_events(events):
+    outboxes = [client['outbox'] for client_id, client in clients.items() if client_id in room_registry]
+    broadcast_json(outboxes, {'type': 'room_events', 'events': events})
+
+def forget_unsaved_messages(rows):
+    # Dropped by the writer: keep history from serving messages that are not in the database.
+    for message_id, room_id, *_ in rows:
+        recent_messages.discard(room_id, message_id)
+
+presence = PresencePublisher(presence_coalesce_ms, publish_room_updates, send_room_events)
+message_writer = database.MessageWriter(db, chat_flush_ms, chat_batch_size, on_dropped=forget_unsaved_messages)
 
 async def main():
     database.init_db(db_file)
+    database.upgrade_schema(db_file)
+    database.reconcile_room_members(db_file)
+    for query, detail in database.audit_query_plans(db_file):
+        logging.warning(f"Full table scan in hot query {query!r}: {detail}")
     database.ensure_default_rooms(db_file)
     database.create_initial_admin(db_file)
     database.create_initial_privilege_key(db_file)
+    room_registry.load_rooms(await db.fetchall("SELECT id, name, password FROM rooms ORDER BY id"))
+    await message_writer.start()
+    for room_name in room_registry.room_names():
+        room_id = room_registry.room_id(room_name)
+        rows = await db.fetchall(database.HISTORY_QUERY, (room_id, message_writer.last_id + 1, history_recent_messages))
+        recent_messages.seed(room_id, [history_entry(row) for row in reversed(rows)])
+    asyncio.create_task(message_writer.run())
 
     if use_ssl:
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
@@ -546,9 +599,29 @@ async def main():
         print(f"Server started on ws://{server_address}:{port}")
 
     if backup_enabled:
-        asyncio.create_task(backup.backup_database(db_file, backup_folder, backup_interval_minutes))
+        asyncio.create_task(backup.backup_database(db, backup_folder, backup_interval_minutes))
+
+    for room_name in mixed_rooms:
+        room_mixers[room_name] = RoomMixer(sample_rate, mixer_tick_ms)
+    if room_mixers:
+        asyncio.create_task(run_mixers(room_mixers, mixer_tick_ms, room_registry.members, deliver_mixed_audio))
 
-    await server.wait_closed()
+    if stats_interval_seconds:
+        asyncio.create_task(log_fanout_stats(stats_interval_seconds, clients))
+
+    if threading.current_thread() is threading.main_thread():
+        # Service managers stop us with SIGTERM: close the server so the finally block flushes chat.
+        # Only the main thread can take signals; server_gui.py runs main() in a worker thread.
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+        except NotImplementedError:
+            pass  # no signal handlers on Windows event loops
+
+    try:
+        await server.wait_closed()
+    finally:
+        await message_writer.close(shutdown_flush_seconds)
+        db.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
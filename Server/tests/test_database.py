@@ -0,0 +1,85 @@
+import ast
+import asyncio
+import os
+import sqlite3
+
+import database
+
+SERVER_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+SQL_KEYWORDS = ('SELECT ', 'INSERT ', 'UPDATE ', 'DELETE ')
+
+def create_db(path):
+    db_file = str(path / 'pyspeak.db')
+    database.init_db(db_file)
+    database.upgrade_schema(db_file)
+    return db_file
+
+def server_queries():
+    """Every SQL string literal in server.py."""
+    with open(SERVER_PY, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return {node.value for node in ast.walk(tree)
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and node.value.startswith(SQL_KEYWORDS)}
+
+def test_upgrade_schema_sets_version(tmp_path):
+    db_file = create_db(tmp_path)
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+    conn.close()
+
+def test_upgrade_schema_is_idempotent(tmp_path):
+    db_file = create_db(tmp_path)
+    database.upgrade_schema(db_file)
+    assert database.audit_query_plans(db_file) == []
+
+def test_hot_queries_use_indexes(tmp_path):
+    assert database.audit_query_plans(create_db(tmp_path)) == []
+
+def test_every_server_query_is_audited():
+    audited = set(database.HOT_QUERIES) | set(database.STARTUP_QUERIES)
+    assert server_queries() - audited == set()
+
+def test_audit_reports_scans_without_indexes(tmp_path):
+    db_file = create_db(tmp_path)
+    conn = sqlite3.connect(db_file)
+    conn.execute("DROP INDEX idx_users_username")
+    conn.close()
+    scanned = {query for query, _ in database.audit_query_plans(db_file)}
+    assert "SELECT id FROM users WHERE username=?" in scanned
+
+def run_writer(tmp_path, failures, max_attempts=3):
+    """Add two messages to a MessageWriter whose first failures commits fail; return (writer, dropped, stored)."""
+    async def scenario():
+        db = database.Database(create_db(tmp_path))
+        dropped = []
+        writer = database.MessageWriter(db, flush_ms=1, max_attempts=max_attempts, on_dropped=dropped.extend)
+        await writer.start()
+        executemany = db.executemany
+        remaining = [failures]
+
+        async def flaky_executemany(sql, rows):
+            if remaining[0]:
+                remaining[0] -= 1
+                raise sqlite3.OperationalError("database is locked")
+            await executemany(sql, rows)
+
+        db.executemany = flaky_executemany
+        writer.add(1, 1, 'first', '2024-01-01 00:00:00')
+        writer.add(1, 1, 'second', '2024-01-01 00:00:01')
+        await writer.close(timeout=1)
+        stored = await db.fetchall("SELECT id, message FROM messages ORDER BY id")
+        db.close()
+        return writer, dropped, stored
+    return asyncio.run(scenario())
+
+def test_message_writer_retries_failed_batch(tmp_path):
+    writer, dropped, stored = run_writer(tmp_path, failures=2)
+    assert stored == [(1, 'first'), (2, 'second')]
+    assert dropped == []
+    assert writer.stats()['written'] == 2
+
+def test_message_writer_drops_batch_after_max_attempts(tmp_path):
+    writer, dropped, stored = run_writer(tmp_path, failures=3)
+    assert stored == []
+    assert [row[0] for row in dropped] == [1, 2]
+    assert writer.stats()['dropped'] == 2
@@ -0,0 +1,25 @@
+from history import RecentMessages
+
+def messages(ids):
+    return [{'id': message_id} for message_id in ids]
+
+def test_short_seed_is_the_whole_history():
+    recent = RecentMessages(size=5)
+    recent.seed(1, messages([1, 2]))
+    assert recent.page(1, limit=10) == (messages([1, 2]), False)
+
+def test_full_seed_reports_more_after_discard():
+    recent = RecentMessages(size=5)
+    recent.seed(1, messages(range(5, 10)))
+    recent.discard(1, 7)
+    # Four messages left, but older rows are still in the database.
+    assert recent.page(1, limit=10) is None
+    assert recent.page(1, limit=2) == (messages([8, 9]), True)
+
+def test_overflow_ends_completeness():
+    recent = RecentMessages(size=3)
+    recent.add(1, {'id': 1})
+    assert recent.page(1, limit=10) == (messages([1]), False)
+    for message_id in range(2, 5):
+        recent.add(1, {'id': message_id})
+    assert recent.page(1, before_id=3, limit=10) is None